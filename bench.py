@@ -0,0 +1,249 @@
+import hashlib
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+try:
+	import resource
+except ImportError:
+	# no rusage on windows, peak RSS is not reported there
+	resource = None
+
+####################################
+######GLOBALS AND CONSTANTS#########
+####################################
+
+here = os.path.dirname(os.path.abspath(__file__))
+interpreter = os.path.join(here, 'interpret.py')
+testdir = os.path.join(here, 'test')
+inputfile = os.path.join(testdir, 'input.txt')
+
+# name, program, input file or None, (original, replacement) edits of the xml
+# the edits generate scaled up variants of the bundled programs
+benchmarks = [
+	("fibonacci", "fibonacci", None, ()),
+	("helloworld", "helloworld", None, ()),
+	("turing", "turing", None, ()),
+	("lfsr", "lfsr", None, ()),
+	("echo", "echo", inputfile, ()),
+	("str_inv", "str_inv", inputfile, ()),
+	("turing_mem2k", "turing", None, (('<arg2 type="int">20</arg2>', '<arg2 type="int">2000</arg2>'),)),
+	("turing_mem8k", "turing", None, (('<arg2 type="int">20</arg2>', '<arg2 type="int">8000</arg2>'),)),
+	("lfsr_1k", "lfsr", None, (('<arg3 type="int">100</arg3>', '<arg3 type="int">1000</arg3>'),)),
+	("lfsr_5k", "lfsr", None, (('<arg3 type="int">100</arg3>', '<arg3 type="int">5000</arg3>'),)),
+	]
+
+# smallest valid program, its run time is the interpreter startup time
+startup_xml = '''<?xml version="1.0" encoding="UTF-8"?>
+<program language="IPPcode22">
+ <instruction order="1" opcode="LABEL">
+  <arg1 type="label">start</arg1>
+ </instruction>
+</program>
+'''
+
+# relative slowdown of the median time or peak RSS counted as a regression
+default_threshold = 0.10
+
+
+####################################
+############FUNCTIONS###############
+####################################
+
+def printhelp():
+	print('Benchmarks interpret.py on the bundled test programs and their scaled up variants')
+	print('Run with:')
+	print('python3 bench.py [args]')
+	print('Args:')
+	print('--trials=<n> :: Timed runs per program, 5 by default')
+	print('--quick :: Only runs the bundled programs, not the scaled up variants')
+	print('--only=<name>[,<name>...] :: Only runs the named benchmarks')
+	print('--interpreter=<file> :: Interpreter to benchmark, interpret.py next to this script by default')
+	print('--save=<file> :: Writes the results as json, to be used as a later --baseline')
+	print('--baseline=<file> :: Compares the results to a saved json and flags regressions')
+	print(f'--threshold=<fraction> :: Slowdown flagged as a regression, {default_threshold} by default')
+	print('--help :: Prints this and exits')
+	print('Exits with 1 if any regression or changed output was found')
+
+def make_program(tmpdir, name, prgname, edits):
+	'''
+	Returns the path of the xml to run, writing edited variants to tmpdir
+	'''
+	path = os.path.join(testdir, prgname + '.xml')
+	if not edits:
+		return path
+	with open(path) as f:
+		xml = f.read()
+	for original, replacement in edits:
+		if original not in xml:
+			raise ValueError(f"Benchmark {name}: {original} not found in {prgname}.xml")
+		xml = xml.replace(original, replacement)
+	path = os.path.join(tmpdir, name + '.xml')
+	with open(path, 'w') as f:
+		f.write(xml)
+	return path
+
+def run_once(interp, xml, infile, extra = ()):
+	'''
+	Runs the interpreter once
+	Returns (wall time, peak RSS in KiB or None, exit code, md5 of stdout)
+	'''
+	cmd = [sys.executable, interp, f'--source={xml}', f'--input={infile or os.devnull}', *extra]
+	with tempfile.TemporaryFile() as out:
+		start = time.perf_counter()
+		proc = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=out, stderr=subprocess.DEVNULL)
+		if resource and hasattr(os, 'wait4'):
+			_, status, usage = os.wait4(proc.pid, 0)
+			walltime = time.perf_counter() - start
+			proc.returncode = os.waitstatus_to_exitcode(status)
+			# linux reports KiB, macos bytes
+			rss = usage.ru_maxrss // 1024 if sys.platform == 'darwin' else usage.ru_maxrss
+		else:
+			proc.wait()
+			walltime = time.perf_counter() - start
+			rss = None
+		out.seek(0)
+		digest = hashlib.md5(out.read()).hexdigest()
+	return walltime, rss, proc.returncode, digest
+
+def count_instructions(interp, xml, infile, tmpdir):
+	'''
+	Number of instructions a program executes, from an untimed --profile run
+	'''
+	report = os.path.join(tmpdir, 'profile.json')
+	run_once(interp, xml, infile, (f'--profile-json={report}',))
+	try:
+		with open(report) as f:
+			return json.load(f)["instructions"]
+	except (OSError, ValueError, KeyError):
+		return None
+	finally:
+		if os.path.exists(report):
+			os.remove(report)
+
+def bench(interp, name, xml, infile, trials, tmpdir):
+	'''
+	Runs one benchmark, returns its result entry
+	'''
+	icnt = count_instructions(interp, xml, infile, tmpdir)
+	runs = [run_once(interp, xml, infile) for _ in range(trials)]
+	times = [r[0] for r in runs]
+	rss = [r[1] for r in runs if r[1] is not None]
+	median = statistics.median(times)
+	return {
+		"name":name,
+		"instructions":icnt,
+		"trials":trials,
+		"median":median,
+		"min":min(times),
+		"max":max(times),
+		"stdev":statistics.stdev(times) if trials > 1 else 0.0,
+		"ips":icnt / median if icnt and median else None,
+		"peak_rss_kib":max(rss) if rss else None,
+		"exit_codes":sorted(set(r[2] for r in runs)),
+		"stdout_md5":runs[0][3],
+		"stable_output":len(set(r[3] for r in runs)) == 1,
+		}
+
+def fmt(value, spec):
+	return '-' if value is None else format(value, spec)
+
+def print_results(results, startup):
+	print(f'startup time = {startup["median"]:.4f} s (min {startup["min"]:.4f} s), peak RSS = {fmt(startup["peak_rss_kib"], "d")} KiB')
+	print(f'{"benchmark":<16}{"instrs":>12}{"median [s]":>12}{"min [s]":>10}{"stdev":>10}{"instr/s":>12}{"RSS [KiB]":>11}{"exit":>6}')
+	for r in results:
+		exits = ','.join(str(c) for c in r["exit_codes"])
+		print(f'{r["name"]:<16}{fmt(r["instructions"], "d"):>12}{r["median"]:>12.4f}{r["min"]:>10.4f}{r["stdev"]:>10.4f}{fmt(r["ips"], ".0f"):>12}{fmt(r["peak_rss_kib"], "d"):>11}{exits:>6}')
+
+def compare(results, startup, baseline, threshold):
+	'''
+	Returns the list of regressions against a saved baseline
+	'''
+	problems = []
+	old = {r["name"]:r for r in baseline.get("results", [])}
+	if "startup" in baseline:
+		old["<startup>"] = baseline["startup"]
+	for r in results + [startup]:
+		b = old.get(r["name"])
+		if b is None:
+			continue
+		if r["median"] > b["median"] * (1 + threshold):
+			problems.append(f'{r["name"]}: median time {b["median"]:.4f} s -> {r["median"]:.4f} s ({100 * (r["median"] / b["median"] - 1):+.1f} %)')
+		if r["peak_rss_kib"] and b.get("peak_rss_kib") and r["peak_rss_kib"] > b["peak_rss_kib"] * (1 + threshold):
+			problems.append(f'{r["name"]}: peak RSS {b["peak_rss_kib"]} KiB -> {r["peak_rss_kib"]} KiB')
+		if r["stdout_md5"] != b.get("stdout_md5") or r["exit_codes"] != b.get("exit_codes"):
+			problems.append(f'{r["name"]}: output or exit code changed')
+	return problems
+
+
+####################################
+###############MAIN#################
+####################################
+
+def main(argv):
+	trials = 5
+	quick = False
+	only = None
+	interp = interpreter
+	save = None
+	baseline = None
+	threshold = default_threshold
+
+	for a in argv[1:]:
+		if a[:6] == "--help":
+			printhelp()
+			exit(0)
+		elif a[:9] == "--trials=":
+			trials = int(a[9:])
+		elif a == "--quick":
+			quick = True
+		elif a[:7] == "--only=":
+			only = a[7:].split(',')
+		elif a[:14] == "--interpreter=":
+			interp = a[14:]
+		elif a[:7] == "--save=":
+			save = a[7:]
+		elif a[:11] == "--baseline=":
+			baseline = a[11:]
+		elif a[:12] == "--threshold=":
+			threshold = float(a[12:])
+		else:
+			print(f"Unknown argument: {a}", file=sys.stderr)
+			exit(10)
+	if trials < 1:
+		print("At least one trial is needed", file=sys.stderr)
+		exit(10)
+
+	selected = [b for b in benchmarks if (only is None or b[0] in only) and not (quick and b[3])]
+	with tempfile.TemporaryDirectory() as tmpdir:
+		startup_path = os.path.join(tmpdir, 'startup.xml')
+		with open(startup_path, 'w') as f:
+			f.write(startup_xml)
+		startup = bench(interp, "<startup>", startup_path, None, trials, tmpdir)
+		results = []
+		for name, prgname, infile, edits in selected:
+			print(f'Running {name}...', file=sys.stderr)
+			xml = make_program(tmpdir, name, prgname, edits)
+			results.append(bench(interp, name, xml, infile, trials, tmpdir))
+
+	print_results(results, startup)
+	data = {"interpreter":os.path.abspath(interp), "python":sys.version.split()[0], "trials":trials, "startup":startup, "results":results}
+	if save:
+		with open(save, 'w') as f:
+			json.dump(data, f, indent=1)
+	if baseline:
+		with open(baseline) as f:
+			problems = compare(results, startup, json.load(f), threshold)
+		unstable = [r["name"] for r in results if not r["stable_output"]]
+		problems += [f'{name}: output differs between trials' for name in unstable]
+		if problems:
+			print('### regressions ###')
+			print('\n'.join(problems))
+			exit(1)
+		print('No regressions against', baseline)
+
+if __name__ == "__main__":
+	main(sys.argv)
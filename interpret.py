@@ -2,14 +2,24 @@
 import xml.etree.ElementTree as ET
 import re
 import pprint
-import copy
+import gc
+import operator
 import sys
+import os
+import io
+import hashlib
+import marshal
+import json
+import time
+import struct
+import mmap
+import zlib
+import itertools
 
 ####################################
 ######GLOBALS AND CONSTANTS#########
 ####################################
 
-orderlist = []
 opcodelist = [
 	"CREATEFRAME", "PUSHFRAME", "POPFRAME", "RETURN", "BREAK", "DEFVAR",
 	"POPS", "CALL", "LABEL", "JUMP", "PUSHS", "WRITE", "EXIT", "DPRINT",
@@ -27,10 +37,39 @@ opcodes_vss_cmp = ["LT", "GT", "EQ"]
 opcodes_vss_log = ["AND", "OR"]
 opcodes_vss_other = ["STRI2INT", "CONCAT", "GETCHAR", "SETCHAR"]
 opcodes_lss = ["JUMPIFEQ", "JUMPIFNEQ"]
-labeldict = dict()
-labels_jumped = set()
-prg = dict()
-vardict = dict()
+# frame ids, index into the frames list of a running program
+GF, LF, TF = 0, 1, 2
+frame_ids = {'GF':GF, 'LF':LF, 'TF':TF}
+# bump when the loaded program representation or the checkpoint format changes,
+# invalidates cached programs and checkpoints
+interpreter_version = "1.3"
+cache_dirname = "__ippcache__"
+# .ippc bytecode files, see bytecode_dump
+bytecode_magic = b'IPPC'
+# bump when the bytecode layout changes, older files are refused
+bytecode_version = 2
+# magic, version, flags, instruction count, first order, constant pool offset,
+# size and entry count, string table offset and size, crc32 of the header
+# before it, the string table and the chunk checksums
+bytecode_header = struct.Struct('<4sHH8I')
+# records and constant pool are checksummed in chunks of this many bytes,
+# the crc32 of each chunk follows the string table
+bytecode_chunk = 65536
+# constant pool offsets and chunk checksums
+bytecode_word = struct.Struct('<I')
+# opcode, arg count, padding and three tagged args
+bytecode_record = struct.Struct('<BBxxIII')
+bytecode_opcodes = opcodelist + ["NOP"]
+# tag in the top 4 bits of a record arg, the low 28 bits are a slot for
+# variables, a LABEL order relative to the first one for labels
+# and an index into the constant pool for literals and types
+ARG_GF, ARG_LF, ARG_TF, ARG_LABEL, ARG_CONST = 1, 2, 3, 4, 5
+arg_shift = 28
+arg_mask = (1 << arg_shift) - 1
+# chars of WRITE and DPRINT output collected before writing them out
+output_bufsize = 65536
+# bytes read from the --input file at once
+input_bufsize = 65536
 pat_var = r"""^[gltGLT][fF]@[a-zA-z_\-$&%*!?][0-9a-zA-z_\-$&%*!?]*$"""
 pat_int = r"""^[+-]?(([1-9][0-9]*)|(0[bB][10]*)|(0[xX][0-9a-fA-F]*)|(0[0-7]*))$"""
 pat_bool = r"""^(true|false)$"""
@@ -38,8 +77,48 @@ pat_string = r"""^[^\x00-\x20\x23]*$""" # exclude ascii 0-32, 35, include 92 bec
 pat_nil = r"""nil"""
 pat_label = r"""^[a-zA-z_\-$&%*!?][0-9a-zA-z_\-$&%*!?]*$"""
 pat_type = r"""^(int|string|bool)$"""
-pat_escape_invalid = r"""\\(?![0-9]{3}).{0,3}"""
-pat_escape_valid = r"""\\[0-9]{3}"""
+pat_escape = r"""\\([0-9]{3})?"""
+pat_xml = r"""&(amp|lt|gt|quot|apos)"""
+# compiled once, pats of each argument kind keyed by xml arg type
+# kinds: v - var, l - label, s - symbol, t - type
+re_var = re.compile(pat_var)
+re_symb = {'var':re_var, 'bool':re.compile(pat_bool), 'int':re.compile(pat_int),
+	'nil':re.compile(pat_nil), 'string':re.compile(pat_string)}
+arg_pats = {'v':{'var':re_var}, 'l':{'label':re.compile(pat_label)},
+	's':re_symb, 't':{'type':re.compile(pat_type)}}
+re_escape = re.compile(pat_escape)
+re_label = arg_pats['l']['label']
+re_type = arg_pats['t']['type']
+# IPPcode22 source as parse.php reads it, see load_text
+# words of a line are separated by \s of its preg_split, trim() strips text_trim
+re_text_split = re.compile(r'[ \t\n\x0b\f\r]+')
+text_trim = ' \t\n\r\0\x0b'
+# parse.php upper and lower cases ascii only
+text_upper = str.maketrans('abcdefghijklmnopqrstuvwxyz', 'ABCDEFGHIJKLMNOPQRSTUVWXYZ')
+text_lower = str.maketrans('ABCDEFGHIJKLMNOPQRSTUVWXYZ', 'abcdefghijklmnopqrstuvwxyz')
+# the words parse.php upper cases to compare them, keyed by every spelling
+text_words = {''.join(spelling):word for word in ('GF', 'LF', 'TF', 'INT', 'BOOL', 'NIL', 'STRING')
+	for spelling in itertools.product(*((c, c.lower()) for c in word))}
+# what parse.php takes an argument for by its first two chars, in any case
+text_kinds = {''.join(spelling):kind for prefix, kind in {'GF':'var', 'LF':'var', 'TF':'var',
+	'IN':'int', 'BO':'bool', 'NI':'nil', 'ST':'string'}.items()
+	for spelling in itertools.product(*((c, c.lower()) for c in prefix))}
+# chars parse.php refuses in variable and label names
+re_text_bad_id = re.compile(r'[-$&%*!?]')
+# operand types parse.php checks, a variable passes any of them
+text_vs_types = {"INT2CHAR":'int', "STRLEN":'string', "NOT":'bool'}
+text_vss_types = {"ADD":('int', 'int'), "SUB":('int', 'int'), "MUL":('int', 'int'),
+	"IDIV":('int', 'int'), "AND":('bool', 'bool'), "OR":('bool', 'bool'),
+	"STRI2INT":('string', 'int'), "GETCHAR":('string', 'int'),
+	"CONCAT":('string', 'string'), "SETCHAR":('int', 'string')}
+re_xml = re.compile(pat_xml)
+xml_chars = {'amp':'&', 'lt':'<', 'gt':'>', 'quot':'"', 'apos':"'"}
+# argument kinds of every opcode
+opcode_sigs = {opcode:sig for group, sig in [
+	(opcodes_0, ''), (opcodes_v, 'v'), (opcodes_l, 'l'), (opcodes_s, 's'),
+	(opcodes_vs, 'vs'), (opcodes_vt, 'vt'), (opcodes_vss_arr, 'vss'),
+	(opcodes_vss_cmp, 'vss'), (opcodes_vss_log, 'vss'), (opcodes_vss_other, 'vss'),
+	(opcodes_lss, 'lss')] for opcode in group}
 
 ####################################
 ############FUNCTIONS###############
@@ -51,19 +130,65 @@ def printhelp():
 	print('python3 interpret.py [args]')
 	print('Args:')
 	print('--source=<file> :: --source is the xml representation of code to run and must follow specification')
+	print('--source-text=<file> :: Like --source, but file is IPPcode22 source, accepted and refused as parse.php and then --source would')
+	print('--source-bytecode=<file> :: Like --source, but file is .ippc bytecode written by --emit-bytecode, mapped into memory')
+	print('    and decoded and compiled per instruction when it first runs, without superinstructions and type specialization,')
+	print(f'    only the header and names are checked on load, each {bytecode_chunk // 1024} KiB of instructions and constants when first read,')
+	print('    --optimize, --blocks, --profile and --checkpoint decode the whole program first and then compile it as usual')
+	print('--lazy :: Checks only the order, opcode, arg count and labels of --source instructions before running, the args')
+	print('    are checked and decoded when an instruction first runs, so a run pays only for the code it reaches,')
+	print('    compiled like --source-bytecode, --cache and --batch load the whole program as usual')
+	print('--emit-bytecode=<file> :: Writes the loaded program to file as .ippc bytecode and exits without running it')
 	print('--input=<file> :: --input is input for READ instructions of said code and can be arbitrary')
+	print(f'--output-buffer=<chars> :: Size of the WRITE and DPRINT output buffer, {output_bufsize} by default, 0 writes immediately')
+	print('--blocks :: Compiles basic blocks of the program to python functions, dispatching once per block')
+	print('--optimize :: Folds constants and drops unreachable instructions before running')
+	print('--optimize-report :: Prints what --optimize changed to stderr, implies --optimize')
+	print('--no-types :: Keeps all runtime type checks, even where types are statically proven')
+	print('--no-fusion :: Runs each instruction on its own, without superinstructions')
+	print('--profile :: Prints execution counts and times per instruction, opcode and block to stderr at exit')
+	print('--profile-json=<file> :: Writes the --profile report as json to file, implies --profile')
+	print('--batch=<dir|file> :: Runs the program on every file of dir or every file listed in file (relative to its directory), one run per input file')
+	print('--batch-out=<dir> :: Writes the stdout, stderr and exit code of each --batch run to <input name>.out, .err and .rc in dir')
+	print('--jobs=<n> :: Worker processes of --batch, the number of cpus by default')
+	print('--checkpoint=<file> :: Periodically writes the machine state to file, it is removed when the program ends')
+	print('--checkpoint-every=<n>|<n>s :: Checkpoint interval in instructions or seconds, 60s by default')
+	print('--resume=<file> :: Continues the same program from a --checkpoint file, with the same --input,')
+	print('    stdout appended (>>) to a file is truncated to its size at the checkpoint')
 	print('--help :: Prints this and exits, overrides all other args')
-	print('At least one of --source or --input must be present')
+	print('--cache :: Caches the analysed program, repeated runs of the same --source skip the analysis')
+	print('--no-cache :: Disables the cache, this is the default')
+	print(f'--cache-dir=<dir> :: Directory of the cache, {cache_dirname} next to --source by default')
+	print('At least one of --source, --source-text, --source-bytecode or --input must be present')
 	print('If only one is present, the other is read from stdin')
+	print('With --batch a json line with the exit code, stdout and stderr of each run is written to stdout,')
+	print('READ reads only from the run\'s input file and the exit code is 0 unless the batch itself fails')
+
+class asmerror(Exception):
+	'''
+	Error of a program, code is its IPP exit code
+	Loading and running raise it, main prints it and exits with code
+	'''
+	def __init__(self, code, msg):
+		super().__init__(msg)
+		self.code = code
+		self.msg = msg
+
+class asmexit(Exception):
+	'''
+	Raised by EXIT, ends the run with code
+	'''
+	def __init__(self, code):
+		super().__init__(code)
+		self.code = code
 
 def eprint(ecode, errstr):
 	'''
-	Error print
+	Error print, raised as asmerror for the caller to report
 	'''
-	print("Error:", errstr, file=sys.stderr)
-	exit(ecode)
+	raise asmerror(ecode, errstr)
 
-def check_order(instr):
+def check_order(program, instr):
 	'''
 	Checks that 'order' xml attribute exists and is a positive number
 	'''
@@ -71,13 +196,16 @@ def check_order(instr):
 		currorder = int(instr.get('order'))
 	except (ValueError, TypeError):
 		try:
-			lastvalid = orderlist[-1]
+			lastvalid = program.orderlist[-1]
 		except IndexError:
 			lastvalid = None
 		eprint(32, f'Missing or invalid instruction order: {instr.get("order")}\nLast valid: {lastvalid}')
 	else:
 		if currorder >= 0:
-			orderlist.append(currorder)
+			if currorder in program.orderset:
+				program.orderdupes.add(currorder)
+			program.orderset.add(currorder)
+			program.orderlist.append(currorder)
 		else:
 			eprint(32, f"Negative instruction order: {currorder}")
 
@@ -99,124 +227,678 @@ def check_args_cnt(instr):
 	Checks the number of args an instruction has
 	'''
 	opcode = instr.get('opcode').upper()
-	argcnt = len(list(instr))
-	if opcode in opcodes_0:
-		if argcnt != 0:
-			eprint(53, f"Incorrect number of ars for {opcode} at order {instr.get('order')} (got {argcnt}, expected 0)")
-	elif opcode in opcodes_v + opcodes_l + opcodes_s:
-		if argcnt != 1:
-			eprint(53, f"Incorrect number of args for {opcode} at order {instr.get('order')} (got {argcnt}, expected 1)")
-	elif opcode in opcodes_vs + opcodes_vt:
-		if argcnt != 2:
-			eprint(53, f"Incorrect number of args for {opcode} at order {instr.get('order')} (got {argcnt}, expected 2)")
-	elif opcode in opcodes_vss_arr + opcodes_vss_cmp + opcodes_vss_log + opcodes_vss_other + opcodes_lss:
-		if argcnt != 3:
-			eprint(53, f"Incorrect number of args for {opcode} at order {instr.get('order')} (got {argcnt}, expected 3)")
-	else:
-		# should be a dead branch
-		eprint(99, f"Failed to check argcnt for {opcode} at order {instr.get('order')}")
+	argcnt = len(instr)
+	expected = len(opcode_sigs[opcode])
+	if argcnt != expected:
+		eprint(53, f"Incorrect number of args for {opcode} at order {instr.get('order')} (got {argcnt}, expected {expected})")
 
 def check_args_types(instr):
 	'''
-	Switch that decides how to call individual argument checks 
-	based on instruction subgroup
+	Checks every argument against the argument kinds
+	the instruction expects, see opcode_sigs
 	'''
 	opcode = instr.get('opcode').upper()
-	if opcode in opcodes_0:
-		return
-	elif opcode in opcodes_v:
-		check_arg_regex('v', instr[0], opcode)
-	elif opcode in opcodes_l:
-		check_arg_regex('l', instr[0], opcode)
-	elif opcode in opcodes_s:
-		check_arg_regex('s', instr[0], opcode)
-	elif opcode in opcodes_vs:
-		check_arg_regex('v', instr[0], opcode)
-		check_arg_regex('s', instr[1], opcode)
-	elif opcode in opcodes_vt:
-		check_arg_regex('v', instr[0], opcode)
-		check_arg_regex('t', instr[1], opcode)
-	elif opcode in opcodes_vss_arr + opcodes_vss_cmp + opcodes_vss_log + opcodes_vss_other:
-		check_arg_regex('v', instr[0], opcode)
-		check_arg_regex('s', instr[1], opcode)
-		check_arg_regex('s', instr[2], opcode)
-	elif opcode in opcodes_lss:
-		check_arg_regex('l', instr[0], opcode)
-		check_arg_regex('s', instr[1], opcode)
-		check_arg_regex('s', instr[2], opcode)
-	else:
-		# should be a dead branch
-		eprint(99, f"Failed to check arg types for {opcode} at order {instr.get('order')}")
+	for switch, arg in zip(opcode_sigs[opcode], instr):
+		check_arg_regex(switch, arg.get('type'), arg.text, opcode)
 
-def check_arg_regex(switch, arg, opcode):
+def check_arg_regex(switch, argtype, argtxt, opcode):
 	'''
 	Checks that argument type matches instruction and does
 	a regex match to check that the value is lexically correct
 	'''
-	argtxt = arg.text if arg.text != None else ""
-	if switch == 'v':
-		argtype = ['var']
-		pat = pat_var
-	elif switch == 'l':
-		argtype = ['label']
-		pat = pat_label
-	elif switch == 's':
-		argtype = ['var', 'bool', 'int', 'nil', 'string']
-		pat_dict = {'var':pat_var, 'bool':pat_bool, 'int':pat_int, 'nil':pat_nil, 'string':pat_string}
-	elif switch == 't':
-		argtype = ['type']
-		pat = pat_type
-	else:
-		# should be a dead branch
-		eprint(99, f"Invalid switch value passed to check_arg_regex")
-	
-	if arg.attrib['type'] not in argtype:
-		eprint(100, f"Arg type {arg.attrib['type']} of {opcode} does not match expected: {argtype}")
-	else:
-		if switch == 's':
-			if arg.attrib['type'] == 'string' and not argtxt:
-				# arg is an empty string literal, re.search doesn't like it -> explicitly catching it here
-				return
-			else:
-				pat = pat_dict[arg.attrib['type']]
-	if re.search(pat, argtxt).group() != arg.text:
-		eprint(100, f"Arg {argtxt} of {opcode} does not match pattern {pat}")
+	argtxt = argtxt if argtxt != None else ""
+	pats = arg_pats[switch]
+	if argtype not in pats:
+		eprint(100, f"Arg type {argtype} of {opcode} does not match expected: {list(pats)}")
+	if pats[argtype].fullmatch(argtxt) == None:
+		eprint(100, f"Arg {argtxt} of {opcode} does not match pattern {pats[argtype].pattern}")
 
-def labeldict_builder(instr):
+def labeldict_builder(program, opcode, label, order):
 	'''
 	Adds new label to labeldict on LABEL instr 
 	or to label check list on jump-type instr
 	'''
-	if instr.get('opcode').upper() == "LABEL":
-		if instr[0].text not in labeldict:
-			labeldict[instr[0].text] = int(instr.get('order'))
+	if opcode == "LABEL":
+		if label not in program.labeldict:
+			program.labeldict[label] = order
 		else:
-			eprint(52, f"Label redefinition: {instr[0].text} at order {instr.get('order')}")
+			eprint(52, f"Label redefinition: {label} at order {order}")
 	else:
-		labels_jumped.add(instr[0].text)
+		program.labels_jumped.add(label)
 
-def check_order_continuity():
+def check_order_continuity(program):
 	'''
 	Checks that the instruction order does not skip numbers
-	or have duplicates
+	or have duplicates, all offenders are reported at once
 	'''
-	dupeset = list(set(num for num in orderlist if orderlist.count(num) > 1))
-	if dupeset:
-		eprint(32, f'Duplicate instruction order: {i}')
-	for i in range(min(orderlist), max(orderlist)+1):
-		if i not in orderlist:
-			eprint(32, f'Instruction order discontinuity at {i - 1}')
+	orderlist = program.orderlist
+	orderset = program.orderset
+	orderdupes = program.orderdupes
+	if not orderlist:
+		return
+	errors = []
+	if orderdupes:
+		errors.append(f"Duplicate instruction order: {', '.join(str(i) for i in sorted(orderdupes))}")
+	low = min(orderlist)
+	high = max(orderlist)
+	if len(orderset) != high - low + 1:
+		# only sorting on the error path, the check itself is O(1)
+		present = sorted(orderset)
+		gaps = [str(prev) for prev, curr in zip(present, present[1:]) if curr != prev + 1]
+		errors.append(f"Instruction order discontinuity at {', '.join(gaps)}")
+	if errors:
+		eprint(32, '\n'.join(errors))
 
-def check_labels():
+def check_labels(program):
 	'''
 	Checks that all labels jumped to are properly defined
 	'''
 	# maybe todo: only check jumps that aren't dead code
 	#print(labeldict)
-	for l in labels_jumped:
-		if l not in labeldict:
+	for l in program.labels_jumped:
+		if l not in program.labeldict:
 			eprint(52, f'Jump to undefined label: {l}')
 
+def load_instr(program, instr):
+	'''
+	Validates a single instruction element and adds it to the program
+	'''
+	if instr.tag.lower() != 'instruction':
+		eprint(32, "Unexpected element at instruction level")
+	check_order(program, instr)
+	check_opcode(instr)
+	check_args_cnt(instr)
+	check_args_types(instr)
+	opcode = instr.get('opcode').upper()
+	if opcode in opcodes_l or opcode in opcodes_lss:
+		labeldict_builder(program, opcode, instr[0].text, int(instr.get('order')))
+	program.prg[int(instr.get('order'))] = {"instr":opcode, "args":tuple(asmarg(typearg = arg.get('type'), val = arg.text) for arg in instr)}
+
+class asmdeferred():
+	'''
+	Instructions of a lazily loaded xml program, kept as the opcode and
+	raw (type, text) args until they first run
+	Loading does only the checks of order, opcode, arg count and labels,
+	decoding does the rest of those of load_instr, with the same error codes
+	'''
+	__slots__ = ('program', 'raw')
+
+	def __init__(self, program):
+		self.program = program
+		self.raw = dict()
+
+	def load(self, instr):
+		'''
+		Checks the structure of a single instruction element and keeps its args
+		'''
+		program = self.program
+		if instr.tag.lower() != 'instruction':
+			eprint(32, "Unexpected element at instruction level")
+		check_order(program, instr)
+		check_opcode(instr)
+		check_args_cnt(instr)
+		opcode = instr.get('opcode').upper()
+		order = int(instr.get('order'))
+		if opcode in opcodes_l or opcode in opcodes_lss:
+			labeldict_builder(program, opcode, instr[0].text, order)
+		raw = tuple((arg.get('type'), arg.text) for arg in instr)
+		# frames are sized by the slot count, so slots are given out now,
+		# in the order resolve_slots would give them out
+		for argtype, text in raw:
+			if argtype == 'var' and text and '@' in text:
+				framename, varname = text.split('@', 1)
+				slots = program.vardict['GF'] if framename.upper() == 'GF' else program.vardict['LF']
+				if varname not in slots:
+					slots[varname] = len(slots)
+		self.raw[order] = (opcode, raw)
+
+	def line(self, order):
+		'''
+		Checks and decodes the args of the instruction of order
+		'''
+		opcode, raw = self.raw[order]
+		for switch, (argtype, text) in zip(opcode_sigs[opcode], raw):
+			check_arg_regex(switch, argtype, text, opcode)
+		args = tuple(asmarg(argtype, text) for argtype, text in raw)
+		for arg in args:
+			resolve_arg(self.program, arg)
+		return {"instr":opcode, "args":args}
+
+def load_program(program, source, lazy = False):
+	'''
+	Streams the xml program from source, a file name or binary file object
+	Each instruction is validated and decoded as soon as its end tag
+	is parsed and then dropped, so the whole tree is never held in memory
+	If lazy is set the args are only decoded when the program needs them,
+	see asmdeferred
+	'''
+	deferred = None
+	if lazy:
+		deferred = asmdeferred(program)
+		program.decoder = deferred.line
+	try:
+		depth = 0
+		for event, elem in ET.iterparse(source, events=('start', 'end')):
+			if event == 'start':
+				if depth == 0:
+					root = elem
+				depth += 1
+				continue
+			depth -= 1
+			if depth == 1:
+				if deferred is None:
+					load_instr(program, elem)
+				else:
+					deferred.load(elem)
+				root.clear()
+	except asmerror:
+		raise
+	except FileNotFoundError:
+		eprint(31, "XML file not found")
+	except Exception as e:
+		eprint(31, f"Failed opening or reading xml file: {e}")
+
+def text_id(word, lineno):
+	'''
+	Checks a variable or label name the way parse.php does, fails with 23
+	'''
+	parts = word.split('@')
+	if re_text_bad_id.search(parts[-1]) or (len(parts) == 2 and text_words.get(parts[0]) not in frame_ids):
+		eprint(23, f"Invalid identifier on line {lineno}: {word}")
+
+def text_int(digits):
+	'''
+	The int literal check of parse.php, a state machine which,
+	unlike the xml arg pattern, lets 0 in a hex number fail it
+	and does not look at the chars after a decimal number
+	'''
+	state = 'start'
+	for c in digits:
+		if state == 'start' or state == 'sign':
+			if c == '0':
+				state = 'zero'
+			elif c in '+-' and state == 'start':
+				state = 'sign'
+			else:
+				state = 'dec' if c in '123456789' else 'fail'
+		elif state == 'zero':
+			if c == 'b':
+				state = 'bin_empty'
+			elif c == 'x':
+				state = 'hex_empty'
+			else:
+				state = 'oct' if c in '1234567' else 'fail'
+		elif state == 'bin_empty':
+			state = 'bin_zero' if c == '0' else 'bin' if c == '1' else 'fail'
+		elif state == 'bin':
+			state = 'bin' if c in '01' else 'fail'
+		elif state == 'oct':
+			state = 'oct' if c in '1234567' else 'fail'
+		elif state == 'dec':
+			if c in 'eE':
+				state = 'exp_empty'
+		elif state == 'exp_empty':
+			state = 'exp_zero' if c == '0' else 'exp_sign' if c in '+-' else 'exp' if c in '123456789' else 'fail'
+		elif state == 'exp_sign' or state == 'exp':
+			state = 'exp' if c in '123456789' else 'fail'
+		elif state == 'hex_empty':
+			if c == '0':
+				state = 'hex_zero'
+			elif c in '123456789abcdefABCDEF':
+				state = 'hex'
+		elif state == 'hex':
+			state = 'hex' if c in '123456789abcdefABCDEF' else 'fail'
+		elif state != 'fail':
+			# bin_zero, exp_zero and hex_zero take no more chars
+			state = 'fail'
+	return state != 'fail'
+
+def text_sym(word, lineno):
+	'''
+	Checks a symbol argument the way parse.php does
+	Returns the (type, text) it writes to xml, fails with 23
+	'''
+	prefix = text_words.get(word.split('@', 1)[0])
+	if prefix == 'BOOL':
+		val = word[5:].translate(text_lower)
+		if val == 'true' or val == 'false':
+			return ('bool', val)
+	elif prefix == 'INT':
+		if text_int(word[4:]):
+			return ('int', word[4:])
+	elif prefix == 'NIL':
+		if word[4:].translate(text_lower) == 'nil':
+			return ('nil', 'nil')
+	elif prefix == 'STRING':
+		val = word[7:]
+		# the (up to) three chars after a backslash have to be digits
+		if '\\' not in val or all(val[i + 1:i + 4].isascii() and val[i + 1:i + 4].isdigit() for i in range(len(val)) if val[i] == '\\'):
+			return ('string', val)
+	elif prefix in frame_ids:
+		text_id(word, lineno)
+		return ('var', text_words[word[:2]] + word[2:])
+	eprint(23, f"Invalid argument on line {lineno}: {word}")
+
+def text_types_ok(opcode, words):
+	'''
+	The operand type checks of parse.php, by the first two chars of each arg
+	Like in parse.php, the last operand of ADD, AND, CONCAT and the like
+	goes unchecked when the one before it is a variable
+	'''
+	kinds = [text_kinds.get(word[:2]) for word in words]
+	if opcode in opcodes_v:
+		return kinds[0] == 'var'
+	if opcode == 'EXIT':
+		return kinds[0] in ('var', 'int')
+	if opcode in opcodes_vs:
+		return kinds[0] == 'var' and (opcode not in text_vs_types or kinds[1] in (text_vs_types[opcode], 'var'))
+	if opcode in opcodes_vt:
+		return kinds[0] == 'var' and words[1].translate(text_upper) in ('INT', 'STRING', 'BOOL')
+	same = words[1:] and (words[1][:2].translate(text_upper) == words[-1][:2].translate(text_upper)
+		or (words[1] in frame_ids and words[-1] in frame_ids))
+	if opcode in opcodes_vss_cmp:
+		return kinds[0] == 'var' and kinds[1] != 'nil' and same
+	if opcode in text_vss_types:
+		first, second = text_vss_types[opcode]
+		return kinds[0] == 'var' and kinds[1] in (first, 'var') and (kinds[2] == second or kinds[1] == 'var')
+	if opcode in opcodes_lss:
+		return same or 'nil' in kinds[1:] or 'var' in kinds[1:]
+	return True
+
+def text_instr(opcode, words, lineno, checked):
+	'''
+	Checks an instruction line the way parse.php does
+	Returns its args as the (type, text) pairs parse.php writes to xml,
+	checked keeps those of the args already seen
+	Fails with 23 where parse.php does
+	'''
+	sig = opcode_sigs[opcode]
+	if len(words) != len(sig):
+		eprint(23, f"Invalid number of arguments on line {lineno}: {opcode} takes {len(sig)}, got {len(words)}")
+	if not text_types_ok(opcode, words):
+		eprint(23, f"Invalid argument type on line {lineno}: {opcode} {' '.join(words)}")
+	raw = []
+	for kind, word in zip(sig, words):
+		arg = checked.get((kind, word))
+		if arg is None:
+			if kind == 's':
+				arg = text_sym(word, lineno)
+			elif kind == 't':
+				if word[:6].translate(text_lower) not in ('int', 'string', 'bool'):
+					eprint(23, f"Invalid type on line {lineno}: {word}")
+				arg = ('type', word[:6])
+			else:
+				text_id(word, lineno)
+				arg = ('var', text_words[word[:2]] + word[2:]) if kind == 'v' else ('label', word)
+			checked[(kind, word)] = arg
+		raw.append(arg)
+	return raw
+
+def load_text(program, source):
+	'''
+	Loads the IPPcode22 source of a program from source, a file name or
+	binary file object, into the program the xml parse.php writes from it
+	would load into, with the same error codes
+	The source is first checked as parse.php checks it, with its codes
+	21 for a missing or invalid header, 22 for an unknown opcode and 23
+	for anything else it refuses, including its quirks; only if that
+	passes the args get the checks of load_instr, with the codes of xml
+	programs (100 for a pattern mismatch, 52, 32, 53)
+	Differences from parse.php: lines are not cut at 1023 bytes as its
+	fgets() cuts them, and strings with & < > " ' are taken as written
+	(parse.php writes them as xml entities without the ';', which the xml
+	loader refuses with 31)
+	'''
+	try:
+		if isinstance(source, str):
+			with open(source, 'rb') as f:
+				data = f.read()
+		else:
+			data = source.read()
+	except OSError as e:
+		eprint(11, f"Failed opening or reading source file: {e}")
+	# parse.php does not mind bytes that are not utf-8, the xml it writes
+	# is then refused with 31 when the loader gets to them
+	try:
+		text = data.decode('utf-8')
+		badline = None
+	except UnicodeDecodeError as e:
+		text = data.decode('utf-8', 'surrogateescape')
+		badline = data.count(b'\n', 0, e.start) + 1
+		baderror = e
+	header = False
+	order = 0
+	# the checks of load_instr run as the lines are read, but parse.php
+	# checks the whole file before them, so their first error waits
+	failed = None
+	# the same lines repeat all over a program, each is checked once, entries
+	# are [opcode, args as the (type, text) of xml, decoded args or None]
+	checked = dict()
+	checked_args = dict()
+	decoded = dict()
+	for lineno, l in enumerate(text.split('\n'), 1):
+		l = l.strip(text_trim).split('#', 1)[0].strip(text_trim)
+		if not header:
+			if not l:
+				continue
+			if l != '.IPPcode22':
+				eprint(21, f"Invalid header on line {lineno}")
+			header = True
+			continue
+		# parse.php also skips lines starting with a form feed, trim() keeps it
+		if not l or l[0] == '\f':
+			continue
+		entry = checked.get(l)
+		if entry is None:
+			words = re_text_split.split(l)
+			opcode = words[0].translate(text_upper)
+			if opcode not in opcode_sigs:
+				eprint(22, f"Invalid opcode on line {lineno}: {words[0]}")
+			entry = checked[l] = [opcode, text_instr(opcode, words[1:], lineno, checked_args), None]
+		if failed is not None:
+			continue
+		order += 1
+		opcode, raw, fields = entry
+		try:
+			if badline is not None and lineno >= badline:
+				eprint(31, f"Source is not valid utf-8: {baderror}")
+			if fields is None:
+				for kind, (argtype, argtxt) in zip(opcode_sigs[opcode], raw):
+					if (argtype, argtxt) not in decoded:
+						check_arg_regex(kind, argtype, argtxt, opcode)
+			if opcode in opcodes_l or opcode in opcodes_lss:
+				labeldict_builder(program, opcode, raw[0][1], order)
+			if fields is None:
+				fields = entry[2] = []
+				for arg in raw:
+					fieldsof = decoded.get(arg)
+					if fieldsof is None:
+						argtype, argtxt = arg
+						if argtype == 'string':
+							# as written, there are no xml entities to replace
+							val = un_escape(argtxt)
+							fieldsof = ('string', val, val, ('string', val))
+						else:
+							decoding = asmarg(argtype, argtxt)
+							fieldsof = (decoding.type, decoding.val, decoding.text, decoding.ref)
+						decoded[arg] = fieldsof
+					fields.append(fieldsof)
+		except asmerror as e:
+			failed = e
+			continue
+		program.orderlist.append(order)
+		program.orderset.add(order)
+		# resolve_slots changes args, so each instruction gets its own
+		program.prg[order] = {"instr":opcode, "args":tuple([asmarg.decoded(*arg) for arg in fields])}
+	if not header:
+		eprint(21, "Missing header")
+	if failed is None and badline is not None:
+		eprint(31, f"Source is not valid utf-8: {baderror}")
+	if failed is not None:
+		raise failed
+
+def cache_path(cache_dir, source, text = False):
+	'''
+	Returns the cache file of a program, keyed by the hash of its source,
+	the frontend that reads it (xml or text, see analyze)
+	and the interpreter version
+	Cached programs are always fully decoded, --lazy does not change them
+	'''
+	frontend = b'text' if text else b'xml'
+	key = hashlib.sha256(interpreter_version.encode() + b'\0' + frontend + b'\0' + source).hexdigest()
+	return os.path.join(cache_dir, key + '.ippcache')
+
+def cache_pack(program):
+	'''
+	Returns the analysed program as plain data that marshal can store
+	'''
+	program.decode_all()
+	code = {order: (line['instr'], tuple((arg.type, arg.val, arg.text, arg.ref) for arg in line['args'])) for order, line in program.prg.items()}
+	return (interpreter_version, code, program.labeldict, program.vardict, program.orderlist)
+
+def cache_unpack(entry):
+	'''
+	Rebuilds the analysed program from cache_pack output
+	'''
+	version, code, labels, slots, orders = entry
+	program = asmprogram()
+	program.prg = {order: {"instr":opcode, "args":tuple(asmarg.decoded(*fields) for fields in args)} for order, (opcode, args) in code.items()}
+	program.labeldict = labels
+	program.vardict = slots
+	program.orderlist = orders
+	program.orderset = set(orders)
+	return program
+
+def cache_load(path):
+	'''
+	Returns the cached analysed program or None
+	A missing, unreadable or foreign entry is just a miss
+	'''
+	try:
+		with open(path, 'rb') as f:
+			entry = marshal.loads(f.read())
+		if entry[0] != interpreter_version:
+			return None
+		return cache_unpack(entry)
+	except Exception:
+		return None
+
+def cache_store(path, program):
+	'''
+	Writes the cache entry of the analysed program, failing to do so is not an error
+	The entry is written aside and renamed, so concurrent runs never see half of it
+	'''
+	tmp = f"{path}.{os.getpid()}.tmp"
+	try:
+		os.makedirs(os.path.dirname(path), exist_ok=True)
+		with open(tmp, 'wb') as f:
+			f.write(marshal.dumps(cache_pack(program)))
+		os.replace(tmp, path)
+	except OSError:
+		try:
+			os.remove(tmp)
+		except OSError:
+			pass
+
+def bytecode_dump(program):
+	'''
+	Returns the analysed program as an .ippc bytecode file
+	Instructions are fixed width records, one per order from the first one,
+	literals go to the constant pool and names to the string table
+	'''
+	program.decode_all()
+	prg = program.prg
+	first = min(prg) if prg else 1
+	count = max(prg) - first + 1 if prg else 0
+	opcodes = {opcode: i for i, opcode in enumerate(bytecode_opcodes)}
+	consts = dict()
+	records = bytearray(count * bytecode_record.size)
+	for i in range(count):
+		# orders the optimizer removed are never reached
+		line = prg.get(first + i, {"instr":"NOP", "args":()})
+		words = [0, 0, 0]
+		for n, arg in enumerate(line['args']):
+			if arg.type == 'var':
+				words[n] = (arg.ref[0] + ARG_GF) << arg_shift | arg.ref[1]
+			elif arg.type == 'label':
+				words[n] = ARG_LABEL << arg_shift | arg.ref[1] - first
+			else:
+				# the type is part of the key, so 1 and true stay apart
+				index = consts.setdefault((arg.type, arg.val, arg.text), len(consts))
+				words[n] = ARG_CONST << arg_shift | index
+		bytecode_record.pack_into(records, i * bytecode_record.size, opcodes[line['instr']], len(line['args']), *words)
+	names = tuple(sorted(slots, key=slots.get) for slots in (program.vardict['GF'], program.vardict['LF']))
+	# the pool is the offsets of its entries and the entries, each marshalled on its own
+	entries = [marshal.dumps(const) for const in consts]
+	offsets = list(itertools.accumulate(map(len, entries), initial=0))
+	pool = struct.pack(f'<{len(offsets)}I', *offsets) + b''.join(entries)
+	strings = marshal.dumps(names + (list(program.labeldict.items()),))
+	body = records + pool
+	crcs = b''.join(bytecode_word.pack(zlib.crc32(body[at:at + bytecode_chunk])) for at in range(0, len(body), bytecode_chunk))
+	pool_at = bytecode_header.size + len(records)
+	fields = (bytecode_magic, bytecode_version, 0, count, first, pool_at, len(pool), len(entries), pool_at + len(pool), len(strings))
+	crc = zlib.crc32(strings + crcs, zlib.crc32(bytecode_header.pack(*fields, 0)[:-bytecode_word.size]))
+	return bytecode_header.pack(*fields, crc) + body + strings + crcs
+
+def bytecode_store(path, program):
+	'''
+	Writes the analysed program to an .ippc bytecode file, see bytecode_dump
+	'''
+	try:
+		with open(path, 'wb') as f:
+			f.write(bytecode_dump(program))
+	except OSError as e:
+		eprint(12, f"Failed writing bytecode file: {e}")
+
+class asmbytecode():
+	'''
+	Decodes the records of a mapped .ippc file one instruction at a time
+	Each chunk of records and constants is checked against its crc32 when
+	first read, literals are decoded once per constant pool entry and shared
+	'''
+	__slots__ = ('data', 'first', 'count', 'pool_at', 'nconsts', 'consts_at', 'end', 'crcs', 'checked', 'args', 'names', 'labels')
+
+	def __init__(self, data, first, count, pool_at, nconsts, end, crcs, gf_names, lf_names, labels):
+		self.data = data
+		self.first = first
+		self.count = count
+		self.pool_at = pool_at
+		self.nconsts = nconsts
+		self.consts_at = pool_at + (nconsts + 1) * bytecode_word.size
+		self.end = end
+		self.crcs = crcs
+		self.checked = bytearray(len(crcs))
+		self.args = dict()
+		# LF and TF names share the LF slots, see resolve_slots
+		self.names = (gf_names, lf_names, lf_names)
+		self.labels = {order: name for name, order in labels}
+
+	def read(self, start, end):
+		'''
+		Returns the file bytes start to end, checking the chunks they lie in first
+		'''
+		checked = self.checked
+		for chunk in range((start - bytecode_header.size) // bytecode_chunk, (end - 1 - bytecode_header.size) // bytecode_chunk + 1):
+			if not checked[chunk]:
+				at = bytecode_header.size + chunk * bytecode_chunk
+				if zlib.crc32(self.data[at:min(at + bytecode_chunk, self.end)]) != self.crcs[chunk]:
+					eprint(31, f"Invalid bytecode file: checksum mismatch at offset {at}")
+				checked[chunk] = 1
+		return self.data[start:end]
+
+	def const(self, index):
+		'''
+		Decodes entry index of the constant pool
+		'''
+		if index >= self.nconsts:
+			raise IndexError(index)
+		at = self.pool_at + index * bytecode_word.size
+		start, end = struct.unpack('<2I', self.read(at, at + 2 * bytecode_word.size))
+		if not start <= end <= self.end - self.consts_at:
+			raise ValueError(index)
+		return marshal.loads(self.read(self.consts_at + start, self.consts_at + end))
+
+	def arg(self, word):
+		tag = word >> arg_shift
+		value = word & arg_mask
+		if tag == ARG_CONST:
+			arg = self.args.get(value)
+			if arg is None:
+				typearg, val, text = self.const(value)
+				arg = self.args[value] = asmarg.decoded(typearg, val, text, (typearg, val))
+			return arg
+		if tag == ARG_LABEL:
+			order = value + self.first
+			name = self.labels[order]
+			return asmarg.decoded('label', name, name, ('label', order))
+		fid = tag - ARG_GF
+		name = f"{('GF', 'LF', 'TF')[fid]}@{self.names[fid][value]}"
+		return asmarg.decoded('var', name, name, (fid, value))
+
+	def line(self, order):
+		'''
+		Decodes the instruction of order, as load_instr would have
+		'''
+		index = order - self.first
+		if not 0 <= index < self.count:
+			eprint(31, f"Invalid bytecode file: no instruction {order}")
+		at = bytecode_header.size + index * bytecode_record.size
+		opcode, argc, *words = bytecode_record.unpack(self.read(at, at + bytecode_record.size))
+		try:
+			return {"instr":bytecode_opcodes[opcode], "args":tuple(self.arg(word) for word in words[:argc])}
+		except (IndexError, KeyError, ValueError, TypeError, EOFError):
+			eprint(31, f"Invalid bytecode file: malformed instruction {order}")
+
+def bytecode_load(fname):
+	'''
+	Maps an .ippc file into memory and checks its header, string table
+	and chunk checksums, so loading costs the same whatever the program size,
+	the records and constants are checked and decoded as the program needs them
+	'''
+	try:
+		with open(fname, 'rb') as f:
+			size = os.fstat(f.fileno()).st_size
+			data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+	except FileNotFoundError:
+		eprint(11, "Bytecode file not found")
+	except OSError as e:
+		eprint(11, f"Failed opening or reading bytecode file: {e}")
+	if size < bytecode_header.size or data[:4] != bytecode_magic:
+		eprint(31, "Not a bytecode file")
+	magic, version, flags, count, first, pool_at, pool_size, nconsts, strings_at, strings_size, crc = bytecode_header.unpack_from(data)
+	if version != bytecode_version:
+		eprint(31, f"Unsupported bytecode version {version}, expected {bytecode_version}")
+	chunks = -(-(strings_at - bytecode_header.size) // bytecode_chunk)
+	crcs_at = strings_at + strings_size
+	if (pool_at != bytecode_header.size + count * bytecode_record.size or strings_at != pool_at + pool_size
+			or pool_size < (nconsts + 1) * bytecode_word.size or crcs_at + chunks * bytecode_word.size != size
+			or zlib.crc32(data[strings_at:], zlib.crc32(data[:bytecode_header.size - bytecode_word.size])) != crc):
+		eprint(31, "Invalid bytecode file: checksum or size mismatch")
+	try:
+		gf_names, lf_names, labels = marshal.loads(data[strings_at:crcs_at])
+	except (EOFError, ValueError, TypeError):
+		eprint(31, "Invalid bytecode file: malformed string table")
+	crcs = struct.unpack_from(f'<{chunks}I', data, crcs_at)
+	program = asmprogram()
+	program.vardict = {'GF':{name: slot for slot, name in enumerate(gf_names)}, 'LF':{name: slot for slot, name in enumerate(lf_names)}}
+	program.labeldict = dict(labels)
+	# orders are contiguous, the range stands in for the list and the set
+	program.orderlist = program.orderset = range(first, first + count)
+	program.decoder = asmbytecode(data, first, count, pool_at, nconsts, strings_at, crcs, gf_names, lf_names, labels).line
+	return program
+
+def read_lines(read_fp):
+	'''
+	Lazily yields the lines READ consumes, those of the --input file
+	and after they run out those of stdin
+	'''
+	if read_fp:
+		with read_fp:
+			for l in read_fp:
+				yield l.rstrip()
+	for l in sys.stdin:
+		yield l.rstrip('\n')
+
+def analyze(program, source, text = False, lazy = False):
+	'''
+	Loads the program from source, xml or if text is set IPPcode22 source,
+	and runs all static checks on it, lazy defers those of xml args,
+	see load_program
+	'''
+	if text:
+		load_text(program, source)
+	else:
+		load_program(program, source, lazy)
+	check_order_continuity(program)
+	check_labels(program)
+	if program.decoder is None:
+		resolve_slots(program)
+	elif program.orderlist:
+		# continuous now, the range stands in for the list and the set
+		program.orderlist = program.orderset = range(min(program.orderlist), max(program.orderlist) + 1)
+	else:
+		program.orderlist = program.orderset = range(1, 1)
+
 def asmvar(vartype, varval):
 	'''
 	Variable constructor
@@ -227,6 +909,15 @@ def asmvar(vartype, varval):
 		eprint(99, f"Variable constructor fail - non-string argument: {vartype}, {varval}")
 
 class asmarg():
+	'''
+	Instruction argument, decoded once at load time
+	ref is the (prefix, name) pair the handlers work with:
+	(frame, varname) for variables, (type, typed value) for literals
+	resolve_slots later turns variable refs into (frame id, slot)
+	text keeps the source representation for WRITE and error messages
+	'''
+	__slots__ = ('type', 'val', 'text', 'ref')
+
 	def __init__(self, typearg, val):
 		self.type = typearg
 		self.val = val
@@ -235,38 +926,525 @@ class asmarg():
 				self.val = ""
 			else:
 				self.val = un_escape(un_xml(val))
+		elif self.type == 'int':
+			try:
+				self.val = int(val, get_base(val))
+			except ValueError:
+				eprint(32, f"Invalid int literal: {val}")
+		elif self.type == 'bool':
+			self.val = True if val == 'true' else False
+		elif self.type == 'nil':
+			self.val = None
+		self.text = self.val if self.type == 'string' else val
+		if self.type == 'var':
+			framename, varname = val.split('@', 1)
+			self.ref = (framename.upper(), varname)
 		else:
-			self.val = val
-	
+			self.ref = (self.type, self.val)
+
+	@classmethod
+	def decoded(cls, typearg, val, text, ref):
+		'''
+		Rebuilds an already decoded argument, skipping the decoding and checks
+		'''
+		arg = cls.__new__(cls)
+		arg.type, arg.val, arg.text, arg.ref = typearg, val, text, ref
+		return arg
+
+	def __repr__(self):
+		return f"<{self.type}::{self.text}>"
+
+class asmval(tuple):
+	'''
+	Typed runtime value held in a variable slot or on the data stack
+	Values are immutable, so MOVE, PUSHS and POPS share them instead of copying
+	'''
+	__slots__ = ()
+	type = property(operator.itemgetter(0))
+	val = property(operator.itemgetter(1))
+
+	def __new__(cls, vartype, varval):
+		return tuple.__new__(cls, (vartype, varval))
+
 	def __repr__(self):
 		return f"<{self.type}::{self.val}>"
 
+class asmstr():
+	'''
+	Mutable buffer backing a string value that CONCAT appends to
+	or SETCHAR modifies, so these don't copy the whole string
+	Behaves like str towards the other instructions, the str form
+	is built lazily and cached until the next modification
+	'''
+	__slots__ = ('chars', 'cache')
+
+	def __init__(self, string):
+		self.chars = list(string)
+		self.cache = string
+
+	def __str__(self):
+		if self.cache is None:
+			self.cache = ''.join(self.chars)
+		return self.cache
+
+	def __len__(self):
+		return len(self.chars)
+
+	def __getitem__(self, index):
+		return self.chars[index]
+
+	def __eq__(self, other):
+		return str(self) == str(other)
+
+	def __lt__(self, other):
+		return str(self) < str(other)
+
+	def __gt__(self, other):
+		return str(self) > str(other)
+
+	def __add__(self, other):
+		return str(self) + str(other)
+
+	def __radd__(self, other):
+		return str(other) + str(self)
+
+	__hash__ = None
+
+	def append(self, string):
+		self.chars.extend(str(string))
+		self.cache = None
+
+	def setchar(self, index, char):
+		self.chars[index] = char
+		self.cache = None
+
+class asmout():
+	'''
+	Buffered writer for WRITE and DPRINT
+	Text is collected and written in bulk once limit chars are pending
+	Writing to the other stream writes out the pending text first,
+	so stdout and stderr output stays in program order
+	'''
+	__slots__ = ('parts', 'size', 'limit', 'file')
+
+	def __init__(self, limit):
+		self.parts = []
+		self.size = 0
+		self.limit = limit
+		self.file = None
+
+	def write(self, file, string):
+		if file is not self.file:
+			self.flush()
+			self.file = file
+		self.parts.append(string)
+		self.size += len(string)
+		if self.size >= self.limit:
+			self.flush()
+
+	def flush(self):
+		if self.parts:
+			self.file.write(''.join(self.parts))
+			self.parts.clear()
+			self.size = 0
+		if self.file is not None:
+			self.file.flush()
+
+# bool and nil results are shared constants, no allocation needed
+bool_vals = {True:asmval('bool', True), False:asmval('bool', False)}
+nil_val = asmval('nil', None)
+
+def snapshot(src):
+	'''
+	Returns src in a form that can be held by another variable or the stack
+	String buffers belong to a single variable, others get their current str
+	'''
+	if isinstance(src.val, asmstr):
+		return asmval('string', str(src.val))
+	return src
+
+# marks a variable slot that was not defined by DEFVAR yet
+# a defined but uninitialized variable holds None
+undef = object()
+
+def resolve_slots(program):
+	'''
+	Replaces variable names in instruction args with slot indices
+	GF names get slots in vardict['GF'], LF and TF names share
+	vardict['LF'], because TF becomes LF on PUSHFRAME
+	Label args get the order of their LABEL, so jumps need no lookup
+	'''
+	for line in program.prg.values():
+		for arg in line['args']:
+			resolve_arg(program, arg)
+
+def resolve_arg(program, arg):
+	'''
+	Resolves the ref of a single arg, see resolve_slots
+	'''
+	if arg.type == 'label':
+		arg.ref = ('label', program.labeldict[arg.val])
+	elif arg.type == 'var':
+		framename, varname = arg.ref
+		slots = program.vardict['GF'] if framename == 'GF' else program.vardict['LF']
+		if varname not in slots:
+			slots[varname] = len(slots)
+		arg.ref = (frame_ids[framename], slots[varname])
+
+def frame_dict(frame, slots):
+	'''
+	Maps variable names to values of a frame, for debug output
+	slots maps the names to slots, see resolve_slots
+	'''
+	if frame is None:
+		return None
+	if isinstance(frame, dict):
+		return {name: frame[slot] for name, slot in slots.items() if slot in frame}
+	return {name: frame[slot] for name, slot in slots.items() if frame[slot] is not undef}
+
+# type bits of the static type inference, the state of a GF variable is
+# the union of the bits of everything it may hold at a program point
+T_UNDEF, T_UNINIT, T_INT, T_STRING, T_BOOL, T_NIL = 1, 2, 4, 8, 16, 32
+T_VALUE = T_INT | T_STRING | T_BOOL | T_NIL
+type_bits = {'int':T_INT, 'string':T_STRING, 'bool':T_BOOL, 'nil':T_NIL}
+bit_types = {bit:name for name, bit in type_bits.items()}
+
+# operand types an instruction can succeed with and the type of its result
+# results of None leave the destination alone, MOVE and READ are special
+# the handler has to fail on every other operand type, --optimize drops
+# what follows an instruction these rules say can not succeed
+type_rules = {
+	"ADD":((T_INT, T_INT), T_INT), "SUB":((T_INT, T_INT), T_INT),
+	"MUL":((T_INT, T_INT), T_INT), "IDIV":((T_INT, T_INT), T_INT),
+	"LT":((T_VALUE & ~T_NIL, T_VALUE & ~T_NIL), T_BOOL),
+	"GT":((T_VALUE & ~T_NIL, T_VALUE & ~T_NIL), T_BOOL),
+	"EQ":((T_VALUE, T_VALUE), T_BOOL),
+	"AND":((T_BOOL, T_BOOL), T_BOOL), "OR":((T_BOOL, T_BOOL), T_BOOL),
+	"NOT":((T_BOOL,), T_BOOL), "INT2CHAR":((T_INT,), T_STRING),
+	"STRI2INT":((T_STRING, T_INT), T_INT), "CONCAT":((T_STRING, T_STRING), T_STRING),
+	"STRLEN":((T_STRING,), T_INT), "GETCHAR":((T_STRING, T_INT), T_STRING),
+	"SETCHAR":((T_INT, T_STRING), T_STRING), "TYPE":((T_VALUE | T_UNINIT,), T_STRING),
+	"POPS":((), T_VALUE), "PUSHS":((T_VALUE,), None), "WRITE":((T_VALUE,), None),
+	"DPRINT":((T_VALUE,), None), "EXIT":((T_INT,), None),
+	"JUMPIFEQ":((T_VALUE, T_VALUE), None), "JUMPIFNEQ":((T_VALUE, T_VALUE), None)}
+
+def type_read(state, arg, allowed):
+	'''
+	Returns the types arg may have when read successfully,
+	narrowing the state of a GF variable to them
+	'''
+	if arg.type != 'var':
+		return type_bits[arg.type] & allowed
+	fid, slot = arg.ref
+	if fid != GF:
+		return allowed
+	bits = state[slot] & allowed
+	state[slot] = bits
+	return bits
+
+def type_transfer(line, state):
+	'''
+	Applies an instruction to the GF variable states in place
+	Returns False if the instruction can not succeed from this state
+	'''
+	instr = line['instr']
+	args = line['args']
+	if instr == 'DEFVAR':
+		fid, slot = args[0].ref
+		if fid == GF:
+			if not state[slot] & T_UNDEF:
+				return False
+			state[slot] = T_UNINIT
+		return True
+	if instr == 'MOVE':
+		result = type_read(state, args[1], T_VALUE)
+	elif instr == 'READ':
+		result = type_bits.get(args[1].val, 0) | T_NIL
+	elif instr in type_rules:
+		allowed, result = type_rules[instr]
+		srcs = args[1:] if result is not None or instr in opcodes_lss else args
+		if instr == 'SETCHAR':
+			# SETCHAR also reads the string it modifies
+			if not type_read(state, args[0], T_STRING):
+				return False
+		for arg, bits in zip(srcs, allowed):
+			if not type_read(state, arg, bits):
+				return False
+	else:
+		return True
+	if result is not None:
+		fid, slot = args[0].ref
+		if fid == GF:
+			if not state[slot] & ~T_UNDEF:
+				return False
+			state[slot] = result
+	return True
+
+def type_successors(line, order, returns):
+	'''
+	Orders that can run after an instruction, RETURN may go back after any CALL
+	'''
+	instr = line['instr']
+	if instr in ['JUMP', 'CALL']:
+		return [line['args'][0].ref[1]]
+	if instr in opcodes_lss:
+		return [order + 1, line['args'][0].ref[1]]
+	if instr == 'RETURN':
+		return returns
+	if instr == 'EXIT':
+		return []
+	return [order + 1]
+
+def infer_types(prg, vardict):
+	'''
+	Dataflow analysis of GF variable types over the control flow graph
+	Returns a dict mapping orders to the tuple of type bits of each
+	GF slot before the instruction runs, unreachable orders are missing
+	LF and TF variables are not tracked, frames are created at runtime
+	'''
+	if not prg:
+		return dict()
+	returns = [order + 1 for order, line in prg.items() if line['instr'] == 'CALL']
+	first = min(prg)
+	states = {first: (T_UNDEF,) * len(vardict['GF'])}
+	work = [first]
+	while work:
+		order = work.pop()
+		state = list(states[order])
+		line = prg[order]
+		if not type_transfer(line, state):
+			continue
+		for nxt in type_successors(line, order, returns):
+			if nxt not in prg:
+				continue
+			old = states.get(nxt)
+			new = tuple(state) if old is None else tuple(a | b for a, b in zip(old, state))
+			if new != old:
+				states[nxt] = new
+				work.append(nxt)
+	return states
+
+def proven_type(state, arg):
+	'''
+	Returns the type bit of the single type arg is proven to hold
+	before an instruction, or None
+	'''
+	if arg.type != 'var':
+		return type_bits.get(arg.type)
+	fid, slot = arg.ref
+	if fid != GF or state[slot] not in [T_INT, T_STRING, T_BOOL, T_NIL]:
+		return None
+	return state[slot]
+
+def proven_defined(state, arg):
+	'''
+	Whether a destination variable is a GF variable proven to be defined
+	'''
+	fid, slot = arg.ref
+	return fid == GF and not state[slot] & T_UNDEF
+
+def const_value(instr, vals):
+	'''
+	Evaluates an instruction on constant (type, value) operands
+	Returns the (type, value) result or None if the instruction would fail
+	JUMPIFEQ and JUMPIFNEQ give whether they jump
+	'''
+	types = [t for t, _ in vals]
+	nums = [v for _, v in vals]
+	if instr in arith_funcs and types == ['int', 'int']:
+		return ('int', arith_funcs[instr](*nums))
+	if instr == 'IDIV' and types == ['int', 'int'] and nums[1] != 0:
+		return ('int', nums[0] // nums[1])
+	if instr in ['LT', 'GT'] and types[0] == types[1] != 'nil':
+		return ('bool', cmp_funcs[instr](*nums))
+	if instr in ['EQ', 'JUMPIFEQ', 'JUMPIFNEQ'] and (types[0] == types[1] or 'nil' in types):
+		equal = types[0] == types[1] and nums[0] == nums[1]
+		if instr == 'EQ':
+			return ('bool', equal)
+		return equal == (instr == 'JUMPIFEQ')
+	if instr in ['AND', 'OR'] and types == ['bool', 'bool']:
+		return ('bool', log_funcs[instr](*nums))
+	if instr == 'NOT' and types == ['bool']:
+		return ('bool', not nums[0])
+	if instr == 'INT2CHAR' and types == ['int'] and 0 <= nums[0] <= 0x10ffff:
+		return ('string', chr(nums[0]))
+	if instr in ['STRI2INT', 'GETCHAR'] and types == ['string', 'int'] and 0 <= nums[1] < len(nums[0]):
+		char = nums[0][nums[1]]
+		return ('int', ord(char)) if instr == 'STRI2INT' else ('string', char)
+	if instr == 'CONCAT' and types == ['string', 'string']:
+		return ('string', nums[0] + nums[1])
+	if instr == 'STRLEN' and types == ['string']:
+		return ('int', len(nums[0]))
+	return None
+
+# instructions whose symbol operands constant propagation may replace by literals
+# WRITE and DPRINT print literals as written, so they keep their variables
+const_srcs = {instr:slice(1, None) for instr in type_rules if type_rules[instr][1] is not None}
+const_srcs.update({"MOVE":slice(1, None), "JUMPIFEQ":slice(1, None), "JUMPIFNEQ":slice(1, None), "PUSHS":slice(0, 1), "EXIT":slice(0, 1)})
+for instr in ["SETCHAR", "TYPE", "POPS"]:
+	del const_srcs[instr]
+
+def const_literal(value):
+	'''
+	Builds a literal argument holding a (type, value) constant
+	'''
+	vtype, val = value
+	if vtype == 'bool':
+		text = 'true' if val else 'false'
+	elif vtype == 'nil':
+		text = 'nil'
+	else:
+		text = val if vtype == 'string' else str(val)
+	return asmarg.decoded(vtype, val, text, value)
+
+def const_operands(line, state):
+	'''
+	Returns the symbol operands of an instruction as (type, value)
+	constants where they are known, None for the others
+	'''
+	srcs = line['args'][const_srcs[line['instr']]]
+	vals = []
+	for arg in srcs:
+		if arg.type != 'var':
+			vals.append(arg.ref)
+		elif arg.ref[0] == GF:
+			vals.append(state[arg.ref[1]])
+		else:
+			vals.append(None)
+	return vals
+
+def const_transfer(line, order, state, returns):
+	'''
+	Applies an instruction to the constant GF variable values in place,
+	returns the orders that can run next
+	'''
+	instr = line['instr']
+	args = line['args']
+	if instr in opcodes_lss:
+		vals = const_operands(line, state)
+		if None not in vals:
+			taken = const_value(instr, vals)
+			if taken is None:
+				return []
+			return [args[0].ref[1]] if taken else [order + 1]
+	if instr in ["DEFVAR", "MOVE", "READ", "POPS"] or (instr in type_rules and type_rules[instr][1] is not None):
+		fid, slot = args[0].ref
+		if fid == GF:
+			value = None
+			if instr == 'MOVE':
+				value = const_operands(line, state)[0]
+			elif instr in const_srcs:
+				vals = const_operands(line, state)
+				if None not in vals:
+					value = const_value(instr, vals)
+			state[slot] = value
+	return type_successors(line, order, returns)
+
+def infer_consts(prg, vardict):
+	'''
+	Constant propagation over the control flow graph, skipping branches
+	that constant conditions never take
+	Returns a dict mapping the reachable orders to the tuple of known
+	(type, value) constants of each GF slot before the instruction,
+	None where the value is not known
+	'''
+	if not prg:
+		return dict()
+	returns = [order + 1 for order, line in prg.items() if line['instr'] == 'CALL']
+	first = min(prg)
+	states = {first: (None,) * len(vardict['GF'])}
+	work = [first]
+	while work:
+		order = work.pop()
+		state = list(states[order])
+		for nxt in const_transfer(prg[order], order, state, returns):
+			if nxt not in prg:
+				continue
+			old = states.get(nxt)
+			new = tuple(state) if old is None else tuple(a if a == b else None for a, b in zip(old, state))
+			if new != old:
+				states[nxt] = new
+				work.append(nxt)
+	return states
+
+def optimize_program(prg, vardict):
+	'''
+	Propagates constants into operands, folds instructions on constant
+	operands, resolves constant conditional jumps and drops instructions
+	that can not be reached from the first one
+	Instructions that would fail on their constant operands are kept as
+	they are, and only destinations proven to be defined are folded,
+	so the program fails with the same error at the same order
+	Returns the report of what was changed
+	'''
+	consts = infer_consts(prg, vardict)
+	types = infer_types(prg, vardict)
+	# each analysis finds a superset of the reachable orders, one skips
+	# branches never taken, the other code after instructions that always fail
+	live = [order for order in sorted(consts) if order in types]
+	report = []
+	for order in live:
+		line = prg[order]
+		instr = line['instr']
+		if instr not in const_srcs:
+			continue
+		state = consts[order]
+		args = list(line['args'])
+		srcs = const_srcs[instr]
+		vals = const_operands(line, state)
+		# error messages name the variable an operand of a wrong type came from
+		allowed = type_rules[instr][0] if instr in type_rules else (T_VALUE,)
+		vals = [val if val is not None and type_bits[val[0]] & bits else None for val, bits in zip(vals, allowed)]
+		propagated = [arg.val for arg, val in zip(args[srcs], vals) if val is not None and arg.type == 'var']
+		args[srcs] = [arg if val is None else const_literal(val) for arg, val in zip(args[srcs], vals)]
+		if instr in opcodes_lss and None not in vals:
+			if const_value(instr, vals) is None:
+				continue
+			if const_value(instr, vals):
+				prg[order] = {"instr":"JUMP", "args":(args[0],)}
+				report.append(f"{order}: {instr} always jumps, now JUMP {args[0].val}")
+			else:
+				prg[order] = {"instr":"NOP", "args":()}
+				report.append(f"{order}: {instr} never jumps, removed")
+			continue
+		if instr not in ['MOVE', 'PUSHS', 'EXIT'] and instr not in opcodes_lss and None not in vals and proven_defined(types[order], args[0]):
+			value = const_value(instr, vals)
+			if value is not None:
+				prg[order] = {"instr":"MOVE", "args":(args[0], const_literal(value))}
+				report.append(f"{order}: {instr} {args[0].val} folded to MOVE {value[0]}@{const_literal(value).text}")
+				continue
+		if propagated:
+			prg[order] = {"instr":instr, "args":tuple(args)}
+			report.append(f"{order}: {instr} uses constant {', '.join(propagated)}")
+	dead = sorted(set(prg).difference(live))
+	for order in dead:
+		report.append(f"{order}: {prg[order]['instr']} unreachable, removed")
+		del prg[order]
+	return report
+
 def un_xml(string):
 	'''
 	Replaces xml representations of its control chars with them
 	'''
-	out = string
-	out = re.sub("&amp", "&", out)
-	out = re.sub("&lt", "<", out)
-	out = re.sub("&gt", ">", out)
-	out = re.sub("&quot", '"', out)
-	out = re.sub("&apos", "'", out)
-	return out
+	if '&' not in string:
+		return string
+	return re_xml.sub(lambda m: xml_chars[m.group(1)], string)
+
+def unescape_seq(match):
+	r'''
+	Decodes a single \xyz escape sequence matched by re_escape
+	'''
+	if match.group(1) == None:
+		eprint(53, f"Invalid escape sequence in string literal: {match.string}")
+	return chr(int(match.group(1)))
 
 def un_escape(string):
 	r'''
 	Replaces \xyz escape sequences in string with the corresponding char
 	'''
-	invalid_seq = re.search(pat_escape_invalid, string)
-	if invalid_seq:
-		eprint(53, f"Invalid escape sequence in string literal: {string}")
-	valid_seq = set(re.findall(pat_escape_valid, string))
-	#print(valid_seq)
-	out = string
-	for esc in valid_seq:
-		out = re.sub(esc[1:], chr(int(esc[1:])), out)
-		out = re.sub(r"\\", "", out)
-	return out
+	if '\\' not in string:
+		return string
+	return re_escape.sub(unescape_seq, string)
 
 def is_var(string):
 	'''
@@ -285,1014 +1463,1846 @@ def get_base(numstring):
 		except IndexError:
 			return 10
 		if first == '0':
-			if second == 'b':
+			if second in 'bB':
 				return 2
-			elif second == 'x':
+			elif second in 'xX':
 				return 16
 			else:
 				return 8
 	return 10
 
 
-def is_2_3_eql(line, fdd):
+####################################
+############HANDLERS################
+####################################
+
+class asmstate():
 	'''
-	Checks if 2nd and 3rd argument of an instr are equal
+	Machine state of a single run of a program
+	frames holds the current GF, LF and TF, indexed by frame id
+	GF is a list of variable slots, see resolve_slots, LF and TF are dicts
+	of only the slots DEFVAR defined in them, so a frame is as big as the code
+	using it and not as the set of all LF and TF names of the program
+	framepool holds cleared frames for CREATEFRAME to reuse
+	WRITE goes to stdout and DPRINT to stderr through the output buffer
+	profile holds the counts and times of a profiled run, see run_profiled
 	'''
-	# get arg2
-	src1pref, src1name = line['args'][1].val.split('@') if line['args'][1].type == 'var' else [line['args'][1].type, line['args'][1].val]
-	if src1pref in fdd:
-		# arg2 var
-		src1frame = fdd[src1pref]
-		if src1frame != None:
-			if src1name in src1frame:
-				if src1frame[src1name] != None:
-					num1 = src1frame[src1name]['val']
-					num1type = src1frame[src1name]['type']
-				else:
-					eprint(54, f"Attempted {instr} from uninitialized variable: {line['args'][1].val} at order {ip}")
-			else:
-				eprint(54, f"Attempted {instr} from undefined variable: {line['args'][1].val} at order {ip}")
+	__slots__ = ('frames', 'framestack', 'framepool', 'datastack', 'callstack',
+		'read_lines', 'icnt', 'vardict', 'output', 'stdout', 'stderr', 'profile')
+
+	def __init__(self, vardict, read_lines, stdout, stderr, output_limit = output_bufsize):
+		self.frames = [[undef] * len(vardict['GF']), None, None]
+		self.framestack = []
+		self.framepool = []
+		self.datastack = []
+		self.callstack = []
+		self.read_lines = read_lines
+		self.icnt = 0
+		self.vardict = vardict
+		self.output = asmout(output_limit)
+		self.stdout = stdout
+		self.stderr = stderr
+		self.profile = None
+
+def sym_getter(arg, instr, order):
+	'''
+	Builds a function that returns the value of a symbol argument
+	'''
+	srcpref, srcname = arg.ref
+	if arg.type != 'var':
+		lit = asmval(srcpref, srcname)
+		def get(frames):
+			return lit
+		return get
+	srcframe_id, srcslot = srcpref, srcname
+	def get(frames):
+		srcframe = frames[srcframe_id]
+		if srcframe is None:
+			eprint(54, f"Attempted {instr} from undefined frame: {arg.val} at order {order}")
+		# undefined slots are undef in GF and missing in LF and TF
+		try:
+			src = srcframe[srcslot]
+		except KeyError:
+			src = undef
+		if src is undef:
+			eprint(54, f"Attempted {instr} from undefined variable: {arg.val} at order {order}")
+		if src is None:
+			eprint(54, f"Attempted {instr} from uninitialized variable: {arg.val} at order {order}")
+		return src
+	return get
+
+def val_getter(arg, instr, order, vtype):
+	'''
+	Builds a function that returns the raw value of a symbol argument
+	and fails with 53 if it is not of type vtype
+	'''
+	srcpref, srcname = arg.ref
+	if arg.type != 'var':
+		if srcpref == vtype:
+			def get(frames):
+				return srcname
 		else:
-			eprint(54, f"Attempted {instr} from undefined frame: {line['args'][1].val} at order {ip}")
+			def get(frames):
+				eprint(53, f"Attempted {instr} with {srcpref} literal: {arg.text} at order {order}")
+		return get
+	sym = sym_getter(arg, instr, order)
+	def get(frames):
+		src = sym(frames)
+		if src.type != vtype:
+			eprint(53, f"Attempted {instr} with {src.type} variable: {arg.val} at order {order}")
+		return src.val
+	return get
+
+def dest_getter(arg, instr, order):
+	'''
+	Builds a function that returns the frame holding a destination variable
+	'''
+	destframe_id, destslot = arg.ref
+	def get(frames):
+		destframe = frames[destframe_id]
+		if destframe is None:
+			eprint(54, f"Attempted {instr} to undefined frame: {arg.val} at order {order}")
+		try:
+			if destframe[destslot] is undef:
+				raise KeyError(destslot)
+		except KeyError:
+			eprint(54, f"Attempted {instr} to undefined variable: {arg.val} at order {order}")
+		return destframe
+	return get
+
+def is_2_3_eql(line, order):
+	'''
+	Builds a check whether 2nd and 3rd argument of an instr are equal
+	'''
+	instr = line['instr']
+	src1 = sym_getter(line['args'][1], instr, order)
+	src2 = sym_getter(line['args'][2], instr, order)
+	def eql(frames):
+		num1 = src1(frames)
+		num2 = src2(frames)
+		if num1.type != num2.type and num1.type != 'nil' and num2.type != 'nil':
+			eprint(53, f"Attempted {instr} with {num1.type} and {num2.type} at order {order}")
+		return num1.type == num2.type and num1.val == num2.val
+	return eql
+
+def op_move(line, order):
+	instr = line['instr']
+	dest = dest_getter(line['args'][0], instr, order)
+	destslot = line['args'][0].ref[1]
+	src = sym_getter(line['args'][1], instr, order)
+	nxt = order + 1
+	if line['args'][1].type == 'var':
+		def h(st):
+			frames = st.frames
+			destframe = dest(frames)
+			destframe[destslot] = snapshot(src(frames))
+			return nxt
 	else:
-		# arg2 literal
-		num1type = src1pref
-		if src1pref == 'int':
-			num1 = int(src1name, get_base(src1name))
-		elif src1pref == 'bool':
-			num1 = True if src2name == 'true' else False
-		elif src1pref == 'string':
-			num1 = src1name
-		elif src1pref == 'nil':
-			num1 = None
-	
-	# get arg3
-	src2pref, src2name = line['args'][2].val.split('@') if line['args'][2].type == 'var' else [line['args'][2].type, line['args'][2].val]
-	if src2pref in fdd:
-		# arg3 var
-		src2frame = fdd[src2pref]
-		if src2frame != None:
-			if src2name in src2frame:
-				if src2frame[src2name] != None:
-					num2 = src2frame[src2name]['val']
-					num2type = src2frame[src2name]['type']
-				else:
-					eprint(54, f"Attempted {instr} from uninitialized variable: {line['args'][2].val} at order {ip}")
-			else:
-				eprint(54, f"Attempted {instr} from undefined variable: {line['args'][2].val} at order {ip}")
+		def h(st):
+			frames = st.frames
+			dest(frames)[destslot] = src(frames)
+			return nxt
+	return h
+
+def op_createframe(line, order):
+	nxt = order + 1
+	def h(st):
+		frames = st.frames
+		tf = frames[TF]
+		# the replaced TF is referenced nowhere else, it is cleared in place
+		if tf is not None:
+			tf.clear()
+		elif st.framepool:
+			frames[TF] = st.framepool.pop()
 		else:
-			eprint(54, f"Attempted {instr} from undefined frame: {line['args'][2].val} at order {ip}")
-	else:
-		# arg3 literal
-		num2type = src2pref
-		if src2pref == 'int':
-			num2 = int(src2name, get_base(src2name))
-		elif src2pref == 'bool':
-			num2 = True if src2name == 'true' else False
-		elif src2pref == 'string':
-			num2 = src2name
-		elif src2pref == 'nil':
-			num2 = None
-	
-	# do the thing
-	return (num1 == num2)
+			frames[TF] = dict()
+		return nxt
+	return h
 
+def op_pushframe(line, order):
+	instr = line['instr']
+	nxt = order + 1
+	def h(st):
+		frames = st.frames
+		if frames[TF] is None:
+			eprint(54, f"Attempted {instr} undefined TF at order {order}")
+		st.framestack.append(frames[TF])
+		frames[LF] = frames[TF]
+		frames[TF] = None
+		return nxt
+	return h
 
+def op_popframe(line, order):
+	instr = line['instr']
+	nxt = order + 1
+	def h(st):
+		frames = st.frames
+		framestack = st.framestack
+		if not framestack:
+			eprint(55, f"Attempted to {instr} with empty framestack at order {order}")
+		# the replaced TF goes back to the pool, so deep recursion
+		# allocates its frames once and not on every call
+		tf = frames[TF]
+		if tf is not None:
+			tf.clear()
+			st.framepool.append(tf)
+		frames[TF] = framestack.pop()
+		frames[LF] = framestack[-1] if framestack else None
+		return nxt
+	return h
 
-####################################
-###############MAIN#################
-####################################
+def op_defvar(line, order):
+	instr = line['instr']
+	arg = line['args'][0]
+	frame_id, slot = arg.ref
+	nxt = order + 1
+	if frame_id == GF:
+		def h(st):
+			gf = st.frames[GF]
+			if gf[slot] is not undef:
+				eprint(52, f"Variable redefinition: {arg.val} at order {order}")
+			gf[slot] = None
+			return nxt
+		return h
+	# LF and TF only have the slots DEFVAR defined
+	def h(st):
+		frame = st.frames[frame_id]
+		if frame is None:
+			eprint(54, f"Attempted {instr} to undefined frame: {arg.val} at order {order}")
+		if slot in frame:
+			eprint(52, f"Variable redefinition: {arg.val} at order {order}")
+		frame[slot] = None
+		return nxt
+	return h
 
+def op_call(line, order):
+	target = line['args'][0].ref[1] + 1
+	def h(st):
+		st.callstack.append(order)
+		return target
+	return h
 
-def main(argv):
-	global orderlist
-	global labeldict
-	global labels_jumped
-	global prg
-	global vardict
-	read_fp = None
-	xml_fname = None
-	read_list = []
-	#print(argv)
-	
-	for a in argv:
-		if a[:6] == "--help":
-			printhelp()
-			exit(0)
-		if a[:8] == "--input=":
-			try:
-				read_fp = open(a[8:], 'r')
-			except:
-				pass
-			else:
-				read_list = [l.rstrip() for l in read_fp]
-				read_fp.close()
-		if a[:9] == "--source=":
-			xml_fname = a[9:]
+def op_return(line, order):
+	instr = line['instr']
+	def h(st):
+		if st.callstack == []:
+			eprint(54, f"{instr} with empty callstack at order {order}")
+		return st.callstack.pop() + 1
+	return h
 
-	if not (read_fp or xml_fname):
-		eprint(10, "At least one of --input or --source must be specified")
+def op_pushs(line, order):
+	instr = line['instr']
+	src = sym_getter(line['args'][0], instr, order)
+	nxt = order + 1
+	def h(st):
+		st.datastack.append(snapshot(src(st.frames)))
+		return nxt
+	return h
 
-	#print("Opening file...")
-	try:
-		#tree = ET.parse('C:/Users/zekug/Desktop/vs/ipp/php/turing.xml')
-		if xml_fname:
-			tree = ET.parse(xml_fname)
-		else:
-			tree = ET.fromstring(input())
-	except FileNotFoundError:
-		eprint(31, "XML file not found")
-	except Exception as e:
-		eprint(31, f"Failed opening or reading xml file: {e}")
-	root = tree.getroot()
+def op_pops(line, order):
+	instr = line['instr']
+	dest = dest_getter(line['args'][0], instr, order)
+	destslot = line['args'][0].ref[1]
+	nxt = order + 1
+	def h(st):
+		if st.datastack == []:
+			eprint(54, f"Attempted {instr} from empty stack at order {order}")
+		dest(st.frames)[destslot] = st.datastack.pop()
+		return nxt
+	return h
 
-	#print("Running analysis...")
-	for instr in root:
-		if instr.tag.lower() != 'instruction':
-			eprint(32, "Unexpected element at instruction level")
-		
-		check_order(instr)
-		check_opcode(instr)
-		check_args_cnt(instr)
-		check_args_types(instr)
-		if instr.get('opcode').upper() in opcodes_l + opcodes_lss:
-			labeldict_builder(instr)
-		prg[int(instr.get('order'))] = {"instr":instr.get('opcode').upper(), "args":[asmarg(typearg = arg.get('type'), val = arg.text) for arg in instr]}
-		
-		
-	check_order_continuity()
-	check_labels()
-	#pprint.pp(labeldict)
-	#print("Analysis OK")
-	#print("Running code...\n")
-	#pprint.pp(prg)
-
-	# control structure setup	
-	framestack = []
-	gf = dict()
-	lf = None
-	tf = None
-	datastack = []
-	callstack = []
-	ip = min(orderlist)
-	# frame decision dict
-	fdd = {'GF':gf, 'LF':lf, 'TF':tf}
-
-	# main loop
-	#  (づ｡◕ヮ◕｡)づ wavy code so pretty
-	icnt = 0
-	while ip in range(min(orderlist), max(orderlist)+1):
-		icnt += 1
-		#pprint.pp(gf)
-		line = prg[ip]
-		instr = line['instr']
-		#print(line)
-		if instr == 'MOVE':
-			destpref, destname = line['args'][0].val.split('@')
-			destframe = fdd[destpref.upper()]
-			if destframe != None:
-				if destname in destframe:
-					srcpref, srcname = line['args'][1].val.split('@') if line['args'][1].type == 'var' else [line['args'][1].type, line['args'][1].val]
-					if srcpref in fdd:
-						# copying var
-						srcframe = fdd[srcpref]
-						if srcframe != None:
-							if srcname in srcframe:
-								if srcframe[srcname] != None:
-									destframe[destname] = copy.deepcopy(srcframe[srcname])
-								else:
-									eprint(54, f"Attempted {instr} from uninitialized variable: {line['args'][1].val} at order {ip}")
-							else:
-								eprint(54, f"Attempted {instr} from undefined variable: {line['args'][1].val} at order {ip}")
-						else:
-							eprint(54, f"Attempted {instr} from undefined frame: {line['args'][1].val} at order {ip}")
-					else:
-						# copying literal
-						if srcpref == 'int':
-							destframe[destname] = {'type':srcpref, 'val':int(srcname, get_base(srcname))}
-						elif srcpref == 'bool':
-							destframe[destname] = {'type':srcpref, 'val':True if srcname == 'true' else False}
-						elif srcpref == 'string':
-							destframe[destname] = {'type':srcpref, 'val':srcname}
-						elif srcpref == 'nil':
-							destframe[destname] = {'type':'nil', 'val':None}
-				else:
-					eprint(54, f"Attempted {instr} to undefined variable: {line['args'][0].val} at order {ip}")
-			else:
-				eprint(54, f"Attempted {instr} to undefined frame: {line['args'][0].val} at order {ip}")
-		elif instr == 'CREATEFRAME':
-			tf = []
-		elif instr == 'PUSHFRAME':
-			if tf != None:
-				framestack.append(tf)
-				lf = framestack[-1]
-				tf = None
-			else:
-				eprint(54, f"Attempted {instr} undefined TF at order {ip}")
-		elif instr == 'POPFRAME':
-			if framestack != []:
-				tf = lf
-				del(framestack[-1])
-				lf = framestack[-1] if framestack != [] else None
-			else:
-				eprint(55, "Attempted to {instr} with empty framestack")
-		elif instr == 'DEFVAR':
-			framename, varname = line['args'][0].val.split('@')
-			frame = fdd[framename]
-			if frame != None:
-				if varname not in frame:
-					frame[varname] = None
-				else:
-					eprint(52, f"Variable redefinition: {line['args'][0].val} at order {ip}")
-		elif instr == 'CALL':
-			callstack.append(ip)
-			ip = labeldict[line['args'][0].val]
-		elif instr == 'RETURN':
-			if callstack != []:
-				ip = callstack[-1]
-				del(callstack[-1])
-			else:
-				eprint(54, f"RETURN with empty callstack at order {ip}")
-		elif instr == 'PUSHS':
-			srcpref, srcname = line['args'][0].val.split('@') if line['args'][0].type == 'var' else [line['args'][0].type, line['args'][0].val]
-			if srcpref in fdd:
-				# pushing var
-				srcframe = fdd[srcpref]
-				if srcframe != None:
-					if srcname in srcframe:
-						if srcframe[srcname] != None:
-							dataframe.append(copy.deepcopy(srcframe[srcname]))
-						else:
-							eprint(54, f"Attempted to {instr} uninitialized variable: {line['args'][0].val} at order {ip}")
-					else:
-						eprint(54, f"Attempted to {instr} undefined variable: {line['args'][0].val} at order {ip}")
-				else:
-					eprint(54, f"Attempted to {instr} from undefined frame: {line['args'][0].val} at order {ip}")
-			else:
-				# pushing literal
-				if srcpref == 'int':
-					dataframe.append({'type':srcpref, 'val':int(srcname, get_base(srcname))})
-				elif srcpref == 'bool':
-					dataframe.append({'type':srcpref, 'val':True if srcname == 'true' else False})
-				elif srcpref == 'string':
-					dataframe.append({'type':srcpref, 'val':srcname})
-				elif srcpref == 'nil':
-					dataframe.append({'type':'nil', 'val':'nil'})
-		elif instr == 'POPS':
-			if datastack != []:
-				destpref, destname = line['args'][0].val.split('@')
-				destframe = fdd[destpref.upper()]
-				if destframe != None:
-					if destname in destframe:
-						destframe[destname] = datastack[-1]
-						del(datastack[-1])
-					else:
-						eprint(54, f"Attempted {instr} to undefined variable: {line['args'][0].val} at order {ip}")
-				else:
-					eprint(54, f"Attempted {instr} to undefined frame: {line['args'][0].val} at order {ip}")
-			else:
-				eprint(54, f"Attempted {instr} from empty stack at order {ip}")
-		elif instr == 'ADD' or instr == 'SUB' or instr == 'MUL' or instr == 'IDIV':
-			destpref, destname = line['args'][0].val.split('@')
-			destframe = fdd[destpref.upper()]
-			if destframe != None:
-				if destname in destframe:
-					
-					# get arg2
-					src1pref, src1name = line['args'][1].val.split('@') if line['args'][1].type == 'var' else [line['args'][1].type, line['args'][1].val]
-					if src1pref in fdd:
-						# arg2 var
-						src1frame = fdd[src1pref]
-						if src1frame != None:
-							if src1name in src1frame:
-								if src1frame[src1name] != None:
-									if src1frame[src1name]['type'] == 'int':
-										num1 = src1frame[src1name]['val']
-									else:
-										eprint(53, f"Attempted {instr} with {src1frame[src1name]['type']} variable: {line['args'][1].val} at order {ip}")
-								else:
-									eprint(54, f"Attempted {instr} from uninitialized variable: {line['args'][1].val} at order {ip}")
-							else:
-								eprint(54, f"Attempted {instr} from undefined variable: {line['args'][1].val} at order {ip}")
-						else:
-							eprint(54, f"Attempted {instr} from undefined frame: {line['args'][1].val} at order {ip}")
-					else:
-						# arg2 literal
-						if src1pref == 'int':
-							num1 = int(src1name, get_base(src1name))
-						else:
-							eprint(53, f"Attempted {instr} with {src1pref} literal: {line['args'][1].val} at order {ip}")
-					
-					# get arg3
-					src2pref, src2name = line['args'][2].val.split('@') if line['args'][2].type == 'var' else [line['args'][2].type, line['args'][2].val]
-					if src2pref in fdd:
-						# arg3 var
-						src2frame = fdd[src2pref]
-						if src2frame != None:
-							if src2name in src2frame:
-								if src2frame[src2name] != None:
-									if src2frame[src2name]['type'] == 'int':
-										num2 = src2frame[src2name]['val']
-									else:
-										eprint(53, f"Attempted {instr} with {src2frame[src2name]['type']} variable: {line['args'][2].val} at order {ip}")
-								else:
-									eprint(54, f"Attempted {instr} from uninitialized variable: {line['args'][2].val} at order {ip}")
-							else:
-								eprint(54, f"Attempted {instr} from undefined variable: {line['args'][2].val} at order {ip}")
-						else:
-							eprint(54, f"Attempted {instr} from undefined frame: {line['args'][2].val} at order {ip}")
-					else:
-						# arg3 literal
-						if src2pref == 'int':
-							num2 = int(src2name, get_base(src2name))
-						else:
-							eprint(53, f"Attempted {instr} with {src2pref} literal: {line['args'][2].val} at order {ip}")
-					
-					# do the thing
-					if instr == 'ADD':
-						destframe[destname] = {'type':'int', 'val':(num1 + num2)}
-					elif instr == 'SUB':
-						destframe[destname] = {'type':'int', 'val':(num1 - num2)}
-					elif instr == 'MUL':
-						destframe[destname] = {'type':'int', 'val':(num1 * num2)}
-					elif instr == 'IDIV':
-						if num2 != 0:
-							destframe[destname] = {'type':'int', 'val':(num1 // num2)}
-						else:
-							eprint(57, f"Zero division at order {ip}")
-				else:
-					eprint(54, f"Attempted {instr} to undefined variable: {line['args'][0].val} at order {ip}")
-			else:
-				eprint(54, f"Attempted {instr} to undefined frame: {line['args'][0].val} at order {ip}")
-		elif instr == 'LT' or instr == 'GT' or instr == 'EQ':
-			destpref, destname = line['args'][0].val.split('@')
-			destframe = fdd[destpref.upper()]
-			if destframe != None:
-				if destname in destframe:
-					
-					# get arg2
-					src1pref, src1name = line['args'][1].val.split('@') if line['args'][1].type == 'var' else [line['args'][1].type, line['args'][1].val]
-					if src1pref in fdd:
-						# arg2 var
-						src1frame = fdd[src1pref]
-						if src1frame != None:
-							if src1name in src1frame:
-								if src1frame[src1name] != None:
-									num1 = src1frame[src1name]['val']
-									num1type = src1frame[src1name]['type']
-								else:
-									eprint(54, f"Attempted {instr} from uninitialized variable: {line['args'][1].val} at order {ip}")
-							else:
-								eprint(54, f"Attempted {instr} from undefined variable: {line['args'][1].val} at order {ip}")
-						else:
-							eprint(54, f"Attempted {instr} from undefined frame: {line['args'][1].val} at order {ip}")
-					else:
-						# arg2 literal
-						num1type = src1pref
-						if src1pref == 'int':
-							num1 = int(src1name, get_base(src1name))
-						elif src1pref == 'bool':
-							num1 = True if src2name == 'true' else False
-						elif src1pref == 'string':
-							num1 = src1name
-						elif src1pref == 'nil':
-							num1 = None
-					
-					# get arg3
-					src2pref, src2name = line['args'][2].val.split('@') if line['args'][2].type == 'var' else [line['args'][2].type, line['args'][2].val]
-					if src2pref in fdd:
-						# arg3 var
-						src2frame = fdd[src2pref]
-						if src2frame != None:
-							if src2name in src2frame:
-								if src2frame[src2name] != None:
-									num2 = src2frame[src2name]['val']
-									num2type = src2frame[src2name]['type']
-								else:
-									eprint(54, f"Attempted {instr} from uninitialized variable: {line['args'][2].val} at order {ip}")
-							else:
-								eprint(54, f"Attempted {instr} from undefined variable: {line['args'][2].val} at order {ip}")
-						else:
-							eprint(54, f"Attempted {instr} from undefined frame: {line['args'][2].val} at order {ip}")
-					else:
-						# arg3 literal
-						num2type = src2pref
-						if src2pref == 'int':
-							num2 = int(src2name, get_base(src2name))
-						elif src2pref == 'bool':
-							num2 = True if src2name == 'true' else False
-						elif src2pref == 'string':
-							num2 = src2name
-						elif src2pref == 'nil':
-							num2 = None
-					
-					# do the thing
-					if num1type == num2type:
-						if instr == 'LT':
-							destframe[destname] = {'type':'int', 'val':(num1 < num2)}
-						elif instr == 'GT':
-							destframe[destname] = {'type':'int', 'val':(num1 > num2)}
-						elif instr == 'EQ':
-							destframe[destname] = {'type':'int', 'val':(num1 == num2)}
-					elif (num1type == 'nil' or num2type == 'nil'):
-						if instr == 'EQ':
-							destframe[destname] = {'type':'int', 'val':(num1 == num2)}
-						else:
-							eprint(54, f"Non-EQ nil comparison at order {ip}")
-				else:
-					eprint(54, f"Attempted {instr} to undefined variable: {line['args'][0].val} at order {ip}")
-			else:
-				eprint(54, f"Attempted {instr} to undefined frame: {line['args'][0].val} at order {ip}")
-		elif instr == 'AND' or instr == 'OR':
-			destpref, destname = line['args'][0].val.split('@')
-			destframe = fdd[destpref.upper()]
-			if destframe != None:
-				if destname in destframe:
-					
-					# get arg2
-					src1pref, src1name = line['args'][1].val.split('@') if line['args'][1].type == 'var' else [line['args'][1].type, line['args'][1].val]
-					if src1pref in fdd:
-						# arg2 var
-						src1frame = fdd[src1pref]
-						if src1frame != None:
-							if src1name in src1frame:
-								if src1frame[src1name] != None:
-									if src1frame[src1name]['type'] == 'bool':
-										num1 = src1frame[src1name]['val']
-									else:
-										eprint(53, f"Attempted {instr} with {src1frame[src1name]['type']} variable: {line['args'][1].val} at order {ip}")
-								else:
-									eprint(54, f"Attempted {instr} from uninitialized variable: {line['args'][1].val} at order {ip}")
-							else:
-								eprint(54, f"Attempted {instr} from undefined variable: {line['args'][1].val} at order {ip}")
-						else:
-							eprint(54, f"Attempted {instr} from undefined frame: {line['args'][1].val} at order {ip}")
-					else:
-						# arg2 literal
-						if src1pref == 'bool':
-							num1 = True if src1name == 'true' else False
-						else:
-							eprint(53, f"Attempted {instr} with {src1pref} literal: {line['args'][1].val} at order {ip}")
-					
-					# get arg3
-					src2pref, src2name = line['args'][2].val.split('@') if line['args'][2].type == 'var' else [line['args'][2].type, line['args'][2].val]
-					if src2pref in fdd:
-						# arg3 var
-						src2frame = fdd[src2pref]
-						if src2frame != None:
-							if src2name in src2frame:
-								if src2frame[src2name] != None:
-									if src2frame[src2name]['type'] == 'bool':
-										num2 = src2frame[src2name]['val']
-									else:
-										eprint(53, f"Attempted {instr} with {src2frame[src2name]['type']} variable: {line['args'][2].val} at order {ip}")
-								else:
-									eprint(54, f"Attempted {instr} from uninitialized variable: {line['args'][2].val} at order {ip}")
-							else:
-								eprint(54, f"Attempted {instr} from undefined variable: {line['args'][2].val} at order {ip}")
-						else:
-							eprint(54, f"Attempted {instr} from undefined frame: {line['args'][2].val} at order {ip}")
-					else:
-						# arg3 literal
-						if src2pref == 'bool':
-							num2 = True if src2name == 'true' else False
-						else:
-							eprint(53, f"Attempted {instr} with {src2pref} literal: {line['args'][2].val} at order {ip}")
-					
-					# do the thing
-					if instr == 'AND':
-						destframe[destname] = {'type':'bool', 'val':(num1 and num2)}
-					elif instr == 'OR':
-						destframe[destname] = {'type':'bool', 'val':(num1 or num2)}
-				else:
-					eprint(54, f"Attempted {instr} to undefined variable: {line['args'][0].val} at order {ip}")
-			else:
-				eprint(54, f"Attempted {instr} to undefined frame: {line['args'][0].val} at order {ip}")
-		elif instr == 'NOT':
-			destpref, destname = line['args'][0].val.split('@')
-			destframe = fdd[destpref.upper()]
-			if destframe != None:
-				if destname in destframe:
-					
-					# get arg2
-					src1pref, src1name = line['args'][1].val.split('@') if line['args'][1].type == 'var' else [line['args'][1].type, line['args'][1].val]
-					if src1pref in fdd:
-						# arg2 var
-						src1frame = fdd[src1pref]
-						if src1frame != None:
-							if src1name in src1frame:
-								if src1frame[src1name] != None:
-									if src1frame[src1name]['type'] == 'bool':
-										num1 = src1frame[src1name]['val']
-									else:
-										eprint(53, f"Attempted {instr} with {src1frame[src1name]['type']} variable: {line['args'][1].val} at order {ip}")
-								else:
-									eprint(54, f"Attempted {instr} from uninitialized variable: {line['args'][1].val} at order {ip}")
-							else:
-								eprint(54, f"Attempted {instr} from undefined variable: {line['args'][1].val} at order {ip}")
-						else:
-							eprint(54, f"Attempted {instr} from undefined frame: {line['args'][1].val} at order {ip}")
-					else:
-						# arg2 literal
-						if src1pref == 'bool':
-							num1 = True if src1name == 'true' else False
-						else:
-							eprint(53, f"Attempted {instr} with {src1pref} literal: {line['args'][1].val} at order {ip}")
+arith_funcs = {'ADD':operator.add, 'SUB':operator.sub, 'MUL':operator.mul}
 
-					# do the thing
-					destframe[destname] = {'type':'bool', 'val':(not num1)}
-				else:
-					eprint(54, f"Attempted {instr} to undefined variable: {line['args'][0].val} at order {ip}")
-			else:
-				eprint(54, f"Attempted {instr} to undefined frame: {line['args'][0].val} at order {ip}")
-		elif instr == 'INT2CHAR':
-			destpref, destname = line['args'][0].val.split('@')
-			destframe = fdd[destpref.upper()]
-			if destframe != None:
-				if destname in destframe:
-					
-					# get arg2
-					src1pref, src1name = line['args'][1].val.split('@') if line['args'][1].type == 'var' else [line['args'][1].type, line['args'][1].val]
-					if src1pref in fdd:
-						# arg2 var
-						src1frame = fdd[src1pref]
-						if src1frame != None:
-							if src1name in src1frame:
-								if src1frame[src1name] != None:
-									try:
-										destframe[destname] = {'type':'string', 'val':chr(src1frame[src1name]['val'])}
-									except TypeError:
-										eprint(58, f"Attempted {instr} with {src1frame[src1name]['type']} variable: {line['args'][1].val} at order {ip}")
-								else:
-									eprint(54, f"Attempted {instr} from uninitialized variable: {line['args'][1].val} at order {ip}")
-							else:
-								eprint(54, f"Attempted {instr} from undefined variable: {line['args'][1].val} at order {ip}")
-						else:
-							eprint(54, f"Attempted {instr} from undefined frame: {line['args'][1].val} at order {ip}")
-					else:
-						# arg2 literal
-						try:
-							destframe[destname] = {'type':'string', 'val':chr(src1name)}
-						except TypeError:
-							eprint(58, f"Attempted {instr} with {src1pref} literal: {line['args'][1].val} at order {ip}")
-				else:
-					eprint(54, f"Attempted {instr} to undefined variable: {line['args'][0].val} at order {ip}")
-			else:
-				eprint(54, f"Attempted {instr} to undefined frame: {line['args'][0].val} at order {ip}")
-		elif instr == 'STRI2INT':
-			destpref, destname = line['args'][0].val.split('@')
-			destframe = fdd[destpref.upper()]
-			if destframe != None:
-				if destname in destframe:
-					
-					# get arg2
-					src1pref, src1name = line['args'][1].val.split('@') if line['args'][1].type == 'var' else [line['args'][1].type, line['args'][1].val]
-					if src1pref in fdd:
-						# arg2 var
-						src1frame = fdd[src1pref]
-						if src1frame != None:
-							if src1name in src1frame:
-								if src1frame[src1name] != None:
-									if src1frame[src1name]['type'] == 'string':
-										num1 = src1frame[src1name]['val']
-									else:
-										eprint(53, f"Attempted {instr} with {src1frame[src1name]['type']} variable: {line['args'][1].val} at order {ip}")
-								else:
-									eprint(54, f"Attempted {instr} from uninitialized variable: {line['args'][1].val} at order {ip}")
-							else:
-								eprint(54, f"Attempted {instr} from undefined variable: {line['args'][1].val} at order {ip}")
-						else:
-							eprint(54, f"Attempted {instr} from undefined frame: {line['args'][1].val} at order {ip}")
-					else:
-						# arg2 literal
-						if src1pref == 'string':
-							num1 = True if src1name == 'true' else False
-						else:
-							eprint(53, f"Attempted {instr} with {src1pref} literal: {line['args'][1].val} at order {ip}")
-					
-					# get arg3
-					src2pref, src2name = line['args'][2].val.split('@') if line['args'][2].type == 'var' else [line['args'][2].type, line['args'][2].val]
-					if src2pref in fdd:
-						# arg3 var
-						src2frame = fdd[src2pref]
-						if src2frame != None:
-							if src2name in src2frame:
-								if src2frame[src2name] != None:
-									if src2frame[src2name]['type'] == 'int':
-										num2 = src2frame[src2name]['val']
-									else:
-										eprint(53, f"Attempted {instr} with {src2frame[src2name]['type']} variable: {line['args'][2].val} at order {ip}")
-								else:
-									eprint(54, f"Attempted {instr} from uninitialized variable: {line['args'][2].val} at order {ip}")
-							else:
-								eprint(54, f"Attempted {instr} from undefined variable: {line['args'][2].val} at order {ip}")
-						else:
-							eprint(54, f"Attempted {instr} from undefined frame: {line['args'][2].val} at order {ip}")
-					else:
-						# arg3 literal
-						if src2pref == 'int':
-							num2 = True if src2name == 'true' else False
-						else:
-							eprint(53, f"Attempted {instr} with {src2pref} literal: {line['args'][2].val} at order {ip}")
-					
-					# do the thing
-					if num2 in range(len(num1)):
-						destframe[destname] = {'type':'int', 'val':ord(num1[num2])}
-					else:
-						eprint(58, f"{instr} index out of bounds at order {ip}")
-				else:
-					eprint(54, f"Attempted {instr} to undefined variable: {line['args'][0].val} at order {ip}")
-			else:
-				eprint(54, f"Attempted {instr} to undefined frame: {line['args'][0].val} at order {ip}")
-		elif instr == 'READ':
-			destpref, destname = line['args'][0].val.split('@')
-			destframe = fdd[destpref.upper()]
-			if destframe != None:
-				if destname in destframe:
-					srctype = line['args'][1].val
-					if srctype in ['int', 'string', 'bool']:
-						if read_list == []:
-							src = input()
-						else:
-							src = read_list[0]
-							del(read_list[0])
-						if srctype == 'int':
-							try:
-								destframe[destname] = {'type':srctype, 'val':int(src, get_base(src))}
-							except ValueError:
-								destframe[destname] = {'type':'nil', 'val':None}
-						elif srctype == 'string':
-							destframe[destname] = {'type':srctype, 'val':src}
-						elif srctype == 'bool':
-							destframe[destname] = {'type':srctype, 'val':True if src == 'true' else False}
-					else:
-						eprint(53, f"Attempted {instr} with invalid type: {srctype} at order {ip}")
-				else:
-					eprint(54, f"Attempted {instr} to undefined variable: {line['args'][0].val} at order {ip}")
-			else:
-				eprint(54, f"Attempted {instr} to undefined frame: {line['args'][0].val} at order {ip}")
-		elif instr == 'WRITE':
-			srcpref, srcname = line['args'][0].val.split('@') if line['args'][0].type == 'var' else [line['args'][0].type, line['args'][0].val]
-			if srcpref in fdd:
-				# writing var
-				srcframe = fdd[srcpref]
-				if srcframe != None:
-					if srcname in srcframe:
-						if srcframe[srcname] != None:
-							print(srcframe[srcname]['val'], end='')
-						else:
-							eprint(54, f"Attempted {instr} from uninitialized variable: {line['args'][0].val} at order {ip}")
-					else:
-						eprint(54, f"Attempted {instr} from undefined variable: {line['args'][0].val} at order {ip}")
-				else:
-					eprint(54, f"Attempted {instr} from undefined frame: {line['args'][0].val} at order {ip}")
-			else:
-				# writing literal
-				print(srcname, end='')
-		elif instr == 'CONCAT':
-			destpref, destname = line['args'][0].val.split('@')
-			destframe = fdd[destpref.upper()]
-			if destframe != None:
-				if destname in destframe:
-					
-					# get arg2
-					src1pref, src1name = line['args'][1].val.split('@') if line['args'][1].type == 'var' else [line['args'][1].type, line['args'][1].val]
-					if src1pref in fdd:
-						# arg2 var
-						src1frame = fdd[src1pref]
-						if src1frame != None:
-							if src1name in src1frame:
-								if src1frame[src1name] != None:
-									if src1frame[src1name]['type'] == 'string':
-										num1 = src1frame[src1name]['val']
-									else:
-										eprint(53, f"Attempted {instr} with {src1frame[src1name]['type']} variable: {line['args'][1].val} at order {ip}")
-								else:
-									eprint(54, f"Attempted {instr} from uninitialized variable: {line['args'][1].val} at order {ip}")
-							else:
-								eprint(54, f"Attempted {instr} from undefined variable: {line['args'][1].val} at order {ip}")
-						else:
-							eprint(54, f"Attempted {instr} from undefined frame: {line['args'][1].val} at order {ip}")
-					else:
-						# arg2 literal
-						if src1pref == 'string':
-							num1 = True if src1name == 'true' else False
-						else:
-							eprint(53, f"Attempted {instr} with {src1pref} literal: {line['args'][1].val} at order {ip}")
-					
-					# get arg3
-					src2pref, src2name = line['args'][2].val.split('@') if line['args'][2].type == 'var' else [line['args'][2].type, line['args'][2].val]
-					if src2pref in fdd:
-						# arg3 var
-						src2frame = fdd[src2pref]
-						if src2frame != None:
-							if src2name in src2frame:
-								if src2frame[src2name] != None:
-									if src2frame[src2name]['type'] == 'string':
-										num2 = src2frame[src2name]['val']
-									else:
-										eprint(53, f"Attempted {instr} with {src2frame[src2name]['type']} variable: {line['args'][2].val} at order {ip}")
-								else:
-									eprint(54, f"Attempted {instr} from uninitialized variable: {line['args'][2].val} at order {ip}")
-							else:
-								eprint(54, f"Attempted {instr} from undefined variable: {line['args'][2].val} at order {ip}")
-						else:
-							eprint(54, f"Attempted {instr} from undefined frame: {line['args'][2].val} at order {ip}")
-					else:
-						# arg3 literal
-						if src2pref == 'string':
-							num2 = src2name
-						else:
-							eprint(53, f"Attempted {instr} with {src2pref} literal: {line['args'][2].val} at order {ip}")
-					
-					# do the thing
-					destframe[destname] = {'type':'string', 'val':num1 + num2}
-				else:
-					eprint(54, f"Attempted {instr} to undefined variable: {line['args'][0].val} at order {ip}")
-			else:
-				eprint(54, f"Attempted {instr} to undefined frame: {line['args'][0].val} at order {ip}")
-		elif instr == 'STRLEN':
-			destpref, destname = line['args'][0].val.split('@')
-			destframe = fdd[destpref.upper()]
-			if destframe != None:
-				if destname in destframe:
-					
-					# get arg2
-					src1pref, src1name = line['args'][1].val.split('@') if line['args'][1].type == 'var' else [line['args'][1].type, line['args'][1].val]
-					if src1pref in fdd:
-						# arg2 var
-						src1frame = fdd[src1pref]
-						if src1frame != None:
-							if src1name in src1frame:
-								if src1frame[src1name] != None:
-									#print(src1frame[src1name])
-									if src1frame[src1name]['type'] == 'string':
-										num1 = src1frame[src1name]['val']
-									else:
-										eprint(53, f"Attempted {instr} with {src1frame[src1name]['type']} variable: {line['args'][1].val} at order {ip}")
-								else:
-									eprint(54, f"Attempted {instr} from uninitialized variable: {line['args'][1].val} at order {ip}")
-							else:
-								eprint(54, f"Attempted {instr} from undefined variable: {line['args'][1].val} at order {ip}")
-						else:
-							eprint(54, f"Attempted {instr} from undefined frame: {line['args'][1].val} at order {ip}")
-					else:
-						# arg2 literal
-						if src1pref == 'string':
-							num1 = src1name
-						else:
-							eprint(53, f"Attempted {instr} with {src1pref} literal: {line['args'][1].val} at order {ip}")
+def op_arith(line, order):
+	instr = line['instr']
+	dest = dest_getter(line['args'][0], instr, order)
+	destslot = line['args'][0].ref[1]
+	num1 = val_getter(line['args'][1], instr, order, 'int')
+	num2 = val_getter(line['args'][2], instr, order, 'int')
+	nxt = order + 1
+	if instr == 'IDIV':
+		def h(st):
+			frames = st.frames
+			destframe = dest(frames)
+			divident = num1(frames)
+			divisor = num2(frames)
+			if divisor == 0:
+				eprint(57, f"Zero division at order {order}")
+			destframe[destslot] = asmval('int', (divident // divisor))
+			return nxt
+	else:
+		func = arith_funcs[instr]
+		def h(st):
+			frames = st.frames
+			destframe = dest(frames)
+			destframe[destslot] = asmval('int', func(num1(frames), num2(frames)))
+			return nxt
+	return h
 
-					
-					# do the thing
-					destframe[destname] = {'type':'int', 'val':len(num1)}
-				else:
-					eprint(54, f"Attempted {instr} to undefined variable: {line['args'][0].val} at order {ip}")
-		elif instr == 'GETCHAR':
-			destpref, destname = line['args'][0].val.split('@')
-			destframe = fdd[destpref.upper()]
-			if destframe != None:
-				if destname in destframe:
-					
-					# get arg2
-					src1pref, src1name = line['args'][1].val.split('@') if line['args'][1].type == 'var' else [line['args'][1].type, line['args'][1].val]
-					if src1pref in fdd:
-						# arg2 var
-						src1frame = fdd[src1pref]
-						if src1frame != None:
-							if src1name in src1frame:
-								if src1frame[src1name] != None:
-									#print(src1frame[src1name])
-									if src1frame[src1name]['type'] == 'string':
-										num1 = src1frame[src1name]['val']
-									else:
-										eprint(53, f"Attempted {instr} with {src1frame[src1name]['type']} variable: {line['args'][1].val} at order {ip}")
-								else:
-									eprint(54, f"Attempted {instr} from uninitialized variable: {line['args'][1].val} at order {ip}")
-							else:
-								eprint(54, f"Attempted {instr} from undefined variable: {line['args'][1].val} at order {ip}")
-						else:
-							eprint(54, f"Attempted {instr} from undefined frame: {line['args'][1].val} at order {ip}")
-					else:
-						# arg2 literal
-						if src1pref == 'string':
-							num1 = src1name
-						else:
-							eprint(53, f"Attempted {instr} with {src1pref} literal: {line['args'][1].val} at order {ip}")
-					
-					# get arg3
-					src2pref, src2name = line['args'][2].val.split('@') if line['args'][2].type == 'var' else [line['args'][2].type, line['args'][2].val]
-					if src2pref in fdd:
-						# arg3 var
-						src2frame = fdd[src2pref]
-						if src2frame != None:
-							if src2name in src2frame:
-								if src2frame[src2name] != None:
-									if src2frame[src2name]['type'] == 'int':
-										num2 = src2frame[src2name]['val']
-									else:
-										eprint(53, f"Attempted {instr} with {src2frame[src2name]['type']} variable: {line['args'][2].val} at order {ip}")
-								else:
-									eprint(54, f"Attempted {instr} from uninitialized variable: {line['args'][2].val} at order {ip}")
-							else:
-								eprint(54, f"Attempted {instr} from undefined variable: {line['args'][2].val} at order {ip}")
-						else:
-							eprint(54, f"Attempted {instr} from undefined frame: {line['args'][2].val} at order {ip}")
-					else:
-						# arg3 literal
-						if src2pref == 'int':
-							num2 = int(src2name, get_base(src2name))
-						else:
-							eprint(53, f"Attempted {instr} with {src2pref} literal: {line['args'][2].val} at order {ip}")
-					
-					# do the thing
-					#print(num2, num1, len(num1))
-					if num2 in range(len(num1)):
-						destframe[destname] = {'type':'string', 'val':num1[num2]}
-					else:
-						eprint(58, f"{instr} index out of bounds at order {ip}")
-				else:
-					eprint(54, f"Attempted {instr} to undefined variable: {line['args'][0].val} at order {ip}")
+cmp_funcs = {'LT':operator.lt, 'GT':operator.gt, 'EQ':operator.eq}
+
+def op_cmp(line, order):
+	instr = line['instr']
+	dest = dest_getter(line['args'][0], instr, order)
+	destslot = line['args'][0].ref[1]
+	src1 = sym_getter(line['args'][1], instr, order)
+	src2 = sym_getter(line['args'][2], instr, order)
+	func = cmp_funcs[instr]
+	nxt = order + 1
+	def h(st):
+		frames = st.frames
+		destframe = dest(frames)
+		num1 = src1(frames)
+		num2 = src2(frames)
+		if num1.type == 'nil' or num2.type == 'nil':
+			if instr != 'EQ':
+				eprint(54, f"Non-EQ nil comparison at order {order}")
+			destframe[destslot] = bool_vals[num1.type == num2.type]
+		elif num1.type == num2.type:
+			destframe[destslot] = bool_vals[func(num1.val, num2.val)]
+		else:
+			eprint(53, f"Attempted {instr} with {num1.type} and {num2.type} at order {order}")
+		return nxt
+	return h
+
+def op_log(line, order):
+	instr = line['instr']
+	dest = dest_getter(line['args'][0], instr, order)
+	destslot = line['args'][0].ref[1]
+	num1 = val_getter(line['args'][1], instr, order, 'bool')
+	nxt = order + 1
+	if instr == 'NOT':
+		def h(st):
+			frames = st.frames
+			destframe = dest(frames)
+			destframe[destslot] = bool_vals[not num1(frames)]
+			return nxt
+		return h
+	num2 = val_getter(line['args'][2], instr, order, 'bool')
+	if instr == 'AND':
+		def h(st):
+			frames = st.frames
+			destframe = dest(frames)
+			destframe[destslot] = bool_vals[num1(frames) & num2(frames)]
+			return nxt
+	else:
+		def h(st):
+			frames = st.frames
+			destframe = dest(frames)
+			destframe[destslot] = bool_vals[num1(frames) | num2(frames)]
+			return nxt
+	return h
+
+def op_int2char(line, order):
+	instr = line['instr']
+	dest = dest_getter(line['args'][0], instr, order)
+	destslot = line['args'][0].ref[1]
+	src = val_getter(line['args'][1], instr, order, 'int')
+	nxt = order + 1
+	def h(st):
+		frames = st.frames
+		destframe = dest(frames)
+		num1 = src(frames)
+		try:
+			destframe[destslot] = asmval('string', chr(num1))
+		except (ValueError, OverflowError):
+			eprint(58, f"Attempted {instr} with invalid ordinal: {num1} at order {order}")
+		return nxt
+	return h
+
+def op_stri2int(line, order):
+	instr = line['instr']
+	dest = dest_getter(line['args'][0], instr, order)
+	destslot = line['args'][0].ref[1]
+	src1 = val_getter(line['args'][1], instr, order, 'string')
+	src2 = val_getter(line['args'][2], instr, order, 'int')
+	nxt = order + 1
+	def h(st):
+		frames = st.frames
+		destframe = dest(frames)
+		num1 = src1(frames)
+		num2 = src2(frames)
+		if not 0 <= num2 < len(num1):
+			eprint(58, f"{instr} index out of bounds at order {order}")
+		destframe[destslot] = asmval('int', ord(num1[num2]))
+		return nxt
+	return h
+
+def op_read(line, order):
+	instr = line['instr']
+	dest = dest_getter(line['args'][0], instr, order)
+	destslot = line['args'][0].ref[1]
+	srctype = line['args'][1].val
+	nxt = order + 1
+	def h(st):
+		destframe = dest(st.frames)
+		if srctype not in ['int', 'string', 'bool']:
+			eprint(53, f"Attempted {instr} with invalid type: {srctype} at order {order}")
+		src = next(st.read_lines, None)
+		if src is None:
+			destframe[destslot] = nil_val
+			return nxt
+		if srctype == 'int':
+			try:
+				destframe[destslot] = asmval(srctype, int(src, get_base(src)))
+			except ValueError:
+				destframe[destslot] = nil_val
+		elif srctype == 'string':
+			destframe[destslot] = asmval(srctype, src)
+		elif srctype == 'bool':
+			destframe[destslot] = asmval(srctype, True if src == 'true' else False)
+		return nxt
+	return h
+
+def op_write(line, order):
+	instr = line['instr']
+	arg = line['args'][0]
+	to_stderr = instr == 'DPRINT'
+	nxt = order + 1
+	if arg.type != 'var':
+		# literals are written as they appear in the source
+		text = str(arg.text)
+		def h(st):
+			st.output.write(st.stderr if to_stderr else st.stdout, text)
+			return nxt
+		return h
+	src = sym_getter(arg, instr, order)
+	def h(st):
+		st.output.write(st.stderr if to_stderr else st.stdout, str(src(st.frames).val))
+		return nxt
+	return h
+
+def op_concat(line, order):
+	instr = line['instr']
+	dest = dest_getter(line['args'][0], instr, order)
+	destslot = line['args'][0].ref[1]
+	src1 = val_getter(line['args'][1], instr, order, 'string')
+	src2 = val_getter(line['args'][2], instr, order, 'string')
+	nxt = order + 1
+	if line['args'][1].ref == line['args'][0].ref and line['args'][1].type == 'var':
+		# CONCAT x x y appends to the buffer of x in place
+		def h(st):
+			frames = st.frames
+			destframe = dest(frames)
+			num1 = src1(frames)
+			num2 = src2(frames)
+			if isinstance(num1, asmstr):
+				num1.append(num2)
 			else:
-				eprint(54, f"Attempted {instr} to undefined frame: {line['args'][0].val} at order {ip}")
-		elif instr == 'SETCHAR':
-			destpref, destname = line['args'][0].val.split('@')
-			destframe = fdd[destpref.upper()]
-			if destframe != None:
-				if destname in destframe:
-					if destframe[destname]['type'] == 'string':
-						# get arg2
-						src1pref, src1name = line['args'][1].val.split('@') if line['args'][1].type == 'var' else [line['args'][1].type, line['args'][1].val]
-						if src1pref in fdd:
-							# arg2 var
-							src1frame = fdd[src1pref]
-							if src1frame != None:
-								if src1name in src1frame:
-									if src1frame[src1name] != None:
-										if src1frame[src1name]['type'] == 'int':
-											num1 = src1frame[src1name]['val']
-										else:
-											eprint(53, f"Attempted {instr} with {src1frame[src1name]['type']} variable: {line['args'][1].val} at order {ip}")
-									else:
-										eprint(54, f"Attempted {instr} from uninitialized variable: {line['args'][1].val} at order {ip}")
-								else:
-									eprint(54, f"Attempted {instr} from undefined variable: {line['args'][1].val} at order {ip}")
-							else:
-								eprint(54, f"Attempted {instr} from undefined frame: {line['args'][1].val} at order {ip}")
-						else:
-							# arg2 literal
-							if src1pref == 'int':
-								num1 = int(src1name, get_base(src2name))
-							else:
-								eprint(53, f"Attempted {instr} with {src1pref} literal: {line['args'][1].val} at order {ip}")
-						
-						# get arg3
-						src2pref, src2name = line['args'][2].val.split('@') if line['args'][2].type == 'var' else [line['args'][2].type, line['args'][2].val]
-						if src2pref in fdd:
-							# arg3 var
-							src2frame = fdd[src2pref]
-							if src2frame != None:
-								if src2name in src2frame:
-									if src2frame[src2name] != None:
-										if src2frame[src2name]['type'] == 'string':
-											num2 = src2frame[src2name]['val']
-										else:
-											eprint(53, f"Attempted {instr} with {src2frame[src2name]['type']} variable: {line['args'][2].val} at order {ip}")
-									else:
-										eprint(54, f"Attempted {instr} from uninitialized variable: {line['args'][2].val} at order {ip}")
-								else:
-									eprint(54, f"Attempted {instr} from undefined variable: {line['args'][2].val} at order {ip}")
-							else:
-								eprint(54, f"Attempted {instr} from undefined frame: {line['args'][2].val} at order {ip}")
-						else:
-							# arg3 literal
-							if src2pref == 'string':
-								num2 = src2name
-							else:
-								eprint(53, f"Attempted {instr} with {src2pref} literal: {line['args'][2].val} at order {ip}")
-						
-						# do the thing
-						if num1 in range(len(destframe[destname]['val'])) and num1 != '':
-							destframe[destname] = {'type':'string', 'val':(destframe[destname]['val'][:num1] + num2[0] + destframe[destname]['val'][num1+1:])}
-						else:
-							eprint(58, f"{instr} index out of bounds at order {ip}")
-					else:
-						eprint(54, f"Attempted {instr} to {destframe[destname]['type']} variable: {line['args'][0].val} at order {ip}")
-				else:
-					eprint(54, f"Attempted {instr} to undefined variable: {line['args'][0].val} at order {ip}")
+				destframe[destslot] = asmval('string', asmstr(num1 + num2))
+			return nxt
+		return h
+	def h(st):
+		frames = st.frames
+		destframe = dest(frames)
+		destframe[destslot] = asmval('string', src1(frames) + src2(frames))
+		return nxt
+	return h
+
+def op_strlen(line, order):
+	instr = line['instr']
+	dest = dest_getter(line['args'][0], instr, order)
+	destslot = line['args'][0].ref[1]
+	src = val_getter(line['args'][1], instr, order, 'string')
+	nxt = order + 1
+	def h(st):
+		frames = st.frames
+		destframe = dest(frames)
+		destframe[destslot] = asmval('int', len(src(frames)))
+		return nxt
+	return h
+
+def op_getchar(line, order):
+	instr = line['instr']
+	dest = dest_getter(line['args'][0], instr, order)
+	destslot = line['args'][0].ref[1]
+	src1 = val_getter(line['args'][1], instr, order, 'string')
+	src2 = val_getter(line['args'][2], instr, order, 'int')
+	nxt = order + 1
+	def h(st):
+		frames = st.frames
+		destframe = dest(frames)
+		num1 = src1(frames)
+		num2 = src2(frames)
+		if not 0 <= num2 < len(num1):
+			eprint(58, f"{instr} index out of bounds at order {order}")
+		destframe[destslot] = asmval('string', num1[num2])
+		return nxt
+	return h
+
+def op_setchar(line, order):
+	instr = line['instr']
+	arg = line['args'][0]
+	dest = dest_getter(arg, instr, order)
+	destslot = arg.ref[1]
+	src1 = val_getter(line['args'][1], instr, order, 'int')
+	src2 = val_getter(line['args'][2], instr, order, 'string')
+	nxt = order + 1
+	def h(st):
+		frames = st.frames
+		destframe = dest(frames)
+		target = destframe[destslot]
+		if target is None:
+			eprint(54, f"Attempted {instr} to uninitialized variable: {arg.val} at order {order}")
+		if target.type != 'string':
+			eprint(54, f"Attempted {instr} to {target.type} variable: {arg.val} at order {order}")
+		num1 = src1(frames)
+		num2 = src2(frames)
+		if not 0 <= num1 < len(target.val) or num2 == '':
+			eprint(58, f"{instr} index out of bounds at order {order}")
+		buf = target.val
+		if not isinstance(buf, asmstr):
+			buf = asmstr(buf)
+			destframe[destslot] = asmval('string', buf)
+		buf.setchar(num1, num2[0])
+		return nxt
+	return h
+
+def op_type(line, order):
+	instr = line['instr']
+	dest = dest_getter(line['args'][0], instr, order)
+	destslot = line['args'][0].ref[1]
+	arg = line['args'][1]
+	srcpref, srcname = arg.ref
+	nxt = order + 1
+	if arg.type != 'var':
+		def h(st):
+			dest(st.frames)[destslot] = asmval('string', srcpref)
+			return nxt
+		return h
+	def h(st):
+		frames = st.frames
+		destframe = dest(frames)
+		srcframe = frames[srcpref]
+		if srcframe is None:
+			eprint(54, f"Attempted {instr} from undefined frame: {arg.val} at order {order}")
+		src = srcframe[srcname] if srcpref == GF else srcframe.get(srcname, undef)
+		if src is undef:
+			eprint(54, f"Attempted {instr} from undefined variable: {arg.val} at order {order}")
+		destframe[destslot] = asmval('string', src.type if src is not None else "")
+		return nxt
+	return h
+
+def op_label(line, order):
+	nxt = order + 1
+	def h(st):
+		# do nothing
+		return nxt
+	return h
+
+def op_jump(line, order):
+	target = line['args'][0].ref[1] + 1
+	def h(st):
+		return target
+	return h
+
+def op_jumpif(line, order):
+	target = line['args'][0].ref[1] + 1
+	eql = is_2_3_eql(line, order)
+	nxt = order + 1
+	if line['instr'] == 'JUMPIFEQ':
+		def h(st):
+			return target if eql(st.frames) else nxt
+	else:
+		def h(st):
+			return nxt if eql(st.frames) else target
+	return h
+
+def op_exit(line, order):
+	instr = line['instr']
+	arg = line['args'][0]
+	src = sym_getter(arg, instr, order)
+	def h(st):
+		code = src(st.frames)
+		if code.type != 'int':
+			eprint(54, f"Attempted {instr} with {code.type} type value: {arg.text} at order {order}")
+		if code.val not in range(50):
+			eprint(57, f"Invalid EXIT code at order {order}")
+		raise asmexit(code.val)
+	return h
+
+def op_break(line, order):
+	nxt = order + 1
+	def h(st):
+		st.output.flush()
+		vardict = st.vardict
+		err = st.stderr
+		print('###### BREAK instr ######', file=err)
+		print(f'ip = {order}', file=err)
+		print(f'instr count = {st.icnt}', file=err)
+		print('### framestack ###', file=err)
+		print(pprint.pformat([frame_dict(frame, vardict['LF']) for frame in st.framestack]), file=err)
+		print('### GF ###', file=err)
+		print(pprint.pformat(frame_dict(st.frames[GF], vardict['GF'])), file=err)
+		print('### LF ###', file=err)
+		print(pprint.pformat(frame_dict(st.frames[LF], vardict['LF'])), file=err)
+		print('### TF ###', file=err)
+		print(pprint.pformat(frame_dict(st.frames[TF], vardict['LF'])), file=err)
+		print('### datastack ###', file=err)
+		print(pprint.pformat(st.datastack), file=err)
+		print('### callstack ###', file=err)
+		print(pprint.pformat(st.callstack), file=err)
+		print('###### end of BREAK instr ######', file=err)
+		return nxt
+	return h
+
+def typed_val(arg):
+	'''
+	Builds a check-free getter of the raw value of a literal or of a GF
+	variable whose type was proven by infer_types
+	'''
+	if arg.type != 'var':
+		val = arg.ref[1]
+		def get(gf):
+			return val
+		return get
+	slot = arg.ref[1]
+	def get(gf):
+		return gf[slot][1]
+	return get
+
+def typed_arith(line, order):
+	instr = line['instr']
+	destslot = line['args'][0].ref[1]
+	num1 = typed_val(line['args'][1])
+	num2 = typed_val(line['args'][2])
+	nxt = order + 1
+	if instr == 'IDIV':
+		def h(st):
+			gf = st.frames[GF]
+			divisor = num2(gf)
+			if divisor == 0:
+				eprint(57, f"Zero division at order {order}")
+			gf[destslot] = asmval('int', num1(gf) // divisor)
+			return nxt
+		return h
+	func = arith_funcs[instr]
+	def h(st):
+		gf = st.frames[GF]
+		gf[destslot] = asmval('int', func(num1(gf), num2(gf)))
+		return nxt
+	return h
+
+def typed_cmp(line, order):
+	destslot = line['args'][0].ref[1]
+	num1 = typed_val(line['args'][1])
+	num2 = typed_val(line['args'][2])
+	func = cmp_funcs.get(line['instr'], log_funcs.get(line['instr']))
+	nxt = order + 1
+	def h(st):
+		gf = st.frames[GF]
+		gf[destslot] = bool_vals[func(num1(gf), num2(gf))]
+		return nxt
+	return h
+
+def typed_not(line, order):
+	destslot = line['args'][0].ref[1]
+	num1 = typed_val(line['args'][1])
+	nxt = order + 1
+	def h(st):
+		gf = st.frames[GF]
+		gf[destslot] = bool_vals[not num1(gf)]
+		return nxt
+	return h
+
+def typed_jumpif(line, order):
+	target = line['args'][0].ref[1] + 1
+	num1 = typed_val(line['args'][1])
+	num2 = typed_val(line['args'][2])
+	nxt = order + 1
+	if line['instr'] == 'JUMPIFEQ':
+		def h(st):
+			gf = st.frames[GF]
+			return target if num1(gf) == num2(gf) else nxt
+	else:
+		def h(st):
+			gf = st.frames[GF]
+			return nxt if num1(gf) == num2(gf) else target
+	return h
+
+def typed_strop(line, order):
+	instr = line['instr']
+	destslot = line['args'][0].ref[1]
+	num1 = typed_val(line['args'][1])
+	nxt = order + 1
+	if instr == 'STRLEN':
+		def h(st):
+			gf = st.frames[GF]
+			gf[destslot] = asmval('int', len(num1(gf)))
+			return nxt
+		return h
+	num2 = typed_val(line['args'][2])
+	if instr == 'GETCHAR':
+		def h(st):
+			gf = st.frames[GF]
+			string = num1(gf)
+			index = num2(gf)
+			if not 0 <= index < len(string):
+				eprint(58, f"{instr} index out of bounds at order {order}")
+			gf[destslot] = asmval('string', string[index])
+			return nxt
+		return h
+	def h(st):
+		gf = st.frames[GF]
+		string = num1(gf)
+		index = num2(gf)
+		if not 0 <= index < len(string):
+			eprint(58, f"{instr} index out of bounds at order {order}")
+		gf[destslot] = asmval('int', ord(string[index]))
+		return nxt
+	return h
+
+log_funcs = {'AND':operator.and_, 'OR':operator.or_}
+
+# check-free handler builders and the operand types they need proven,
+# None means both operands of any one single non-nil type
+typed_table = {
+	"ADD":(typed_arith, (T_INT, T_INT)), "SUB":(typed_arith, (T_INT, T_INT)),
+	"MUL":(typed_arith, (T_INT, T_INT)), "IDIV":(typed_arith, (T_INT, T_INT)),
+	"LT":(typed_cmp, None), "GT":(typed_cmp, None), "EQ":(typed_cmp, None),
+	"AND":(typed_cmp, (T_BOOL, T_BOOL)), "OR":(typed_cmp, (T_BOOL, T_BOOL)),
+	"NOT":(typed_not, (T_BOOL,)), "JUMPIFEQ":(typed_jumpif, None),
+	"JUMPIFNEQ":(typed_jumpif, None), "STRLEN":(typed_strop, (T_STRING,)),
+	"GETCHAR":(typed_strop, (T_STRING, T_INT)), "STRI2INT":(typed_strop, (T_STRING, T_INT))}
+
+def proven_operands(line, state):
+	'''
+	Whether infer_types proved that an instruction can only fail on
+	the checks its typed_table handler still does (zero division, bounds)
+	'''
+	instr = line['instr']
+	args = line['args']
+	if instr not in typed_table:
+		return False
+	if instr not in opcodes_lss and not proven_defined(state, args[0]):
+		return False
+	srcs = args[1:]
+	types = [proven_type(state, arg) for arg in srcs]
+	needed = typed_table[instr][1]
+	if needed is None:
+		return types[0] is not None and types[0] == types[1] and types[0] != T_NIL
+	return list(needed) == types
+
+def specialize_program(prg, code, states):
+	'''
+	Replaces the handlers of instructions whose operand types are proven
+	with check-free ones, returns the set of their orders
+	'''
+	typed = set()
+	for order, line in prg.items():
+		state = states.get(order)
+		if state is not None and proven_operands(line, state):
+			code[order] = typed_table[line['instr']][0](line, order)
+			typed.add(order)
+	return typed
+
+# opcode dispatch table, maps each opcode to its handler builder
+handler_table = {
+	"MOVE":op_move, "CREATEFRAME":op_createframe, "PUSHFRAME":op_pushframe,
+	"POPFRAME":op_popframe, "DEFVAR":op_defvar, "CALL":op_call,
+	"RETURN":op_return, "PUSHS":op_pushs, "POPS":op_pops,
+	"ADD":op_arith, "SUB":op_arith, "MUL":op_arith, "IDIV":op_arith,
+	"LT":op_cmp, "GT":op_cmp, "EQ":op_cmp,
+	"AND":op_log, "OR":op_log, "NOT":op_log,
+	"INT2CHAR":op_int2char, "STRI2INT":op_stri2int, "READ":op_read,
+	"WRITE":op_write, "CONCAT":op_concat, "STRLEN":op_strlen,
+	"GETCHAR":op_getchar, "SETCHAR":op_setchar, "TYPE":op_type,
+	"LABEL":op_label, "JUMP":op_jump, "JUMPIFEQ":op_jumpif,
+	"JUMPIFNEQ":op_jumpif, "EXIT":op_exit, "DPRINT":op_write,
+	"BREAK":op_break,
+	# no-op left by the optimizer in place of a conditional jump never taken
+	"NOP":op_label}
+
+def compile_program(prg):
+	'''
+	Compiles every instruction of prg into a bound handler
+	Each handler takes the machine state and returns the order
+	of the next instruction to run
+	'''
+	return {order: handler_table[line['instr']](line, order) for order, line in prg.items()}
+
+def dense_code(code, first, last):
+	'''
+	Lays the compiled handlers out in a list indexed directly by order,
+	so the main loop steps without hashing
+	Orders with no handler (below the first one, removed by the optimizer
+	or inside a block) hold None, jumps never land there
+	When the orders below the first one outnumber the program, like with
+	a program starting at order 2000000000, it is a dict of the same entries
+	'''
+	if first > last - first + 1:
+		return {order: code.get(order) for order in range(first, last + 1)}
+	dense = [None] * (last + 1)
+	for order, h in code.items():
+		dense[order] = h
+	return dense
+
+
+def fuse_arith_jumpif(line1, line2, order):
+	'''
+	Superinstruction for ADD, SUB or MUL followed by JUMPIFEQ or JUMPIFNEQ,
+	the loop counter idiom
+	'''
+	instr = line1['instr']
+	args = line1['args']
+	dest = dest_getter(args[0], instr, order)
+	destslot = args[0].ref[1]
+	num1 = val_getter(args[1], instr, order, 'int')
+	num2 = val_getter(args[2], instr, order, 'int')
+	func = arith_funcs[instr]
+	target = line2['args'][0].ref[1] + 1
+	eql = is_2_3_eql(line2, order + 1)
+	jump_on = line2['instr'] == 'JUMPIFEQ'
+	nxt = order + 2
+	def h(st):
+		frames = st.frames
+		destframe = dest(frames)
+		destframe[destslot] = asmval('int', func(num1(frames), num2(frames)))
+		st.icnt += 1
+		return target if eql(frames) == jump_on else nxt
+	return h
+
+def fuse_getchar_stri2int(line1, line2, order):
+	'''
+	Superinstruction for GETCHAR x s i followed by STRI2INT y x int@0,
+	reading the ordinal value of a char, or None if the pair doesn't match
+	The char is not stored if y overwrites it anyway
+	'''
+	args1 = line1['args']
+	args2 = line2['args']
+	if not (args2[1].type == 'var' and args2[1].ref == args1[0].ref and args2[2].type == 'int' and args2[2].val == 0):
+		return None
+	instr = line1['instr']
+	dest = dest_getter(args1[0], instr, order)
+	destslot = args1[0].ref[1]
+	src1 = val_getter(args1[1], instr, order, 'string')
+	src2 = val_getter(args1[2], instr, order, 'int')
+	dest2 = dest_getter(args2[0], line2['instr'], order + 1)
+	dest2slot = args2[0].ref[1]
+	keep_char = args2[0].ref != args1[0].ref
+	nxt = order + 2
+	def h(st):
+		frames = st.frames
+		destframe = dest(frames)
+		num1 = src1(frames)
+		num2 = src2(frames)
+		if not 0 <= num2 < len(num1):
+			eprint(58, f"{instr} index out of bounds at order {order}")
+		char = num1[num2]
+		st.icnt += 1
+		dest2frame = dest2(frames)
+		if keep_char:
+			destframe[destslot] = asmval('string', char)
+		dest2frame[dest2slot] = asmval('int', ord(char))
+		return nxt
+	return h
+
+def fuse_pair(first, second):
+	'''
+	Runs two straight-line handlers with a single dispatch
+	'''
+	def h(st):
+		first(st)
+		st.icnt += 1
+		return second(st)
+	return h
+
+# superinstruction builders for instruction pairs
+fused_table = {(op1, op2):fuse_arith_jumpif for op1 in arith_funcs for op2 in opcodes_lss}
+fused_table[("GETCHAR", "STRI2INT")] = fuse_getchar_stri2int
+# instructions that may continue elsewhere than the next order
+opcodes_flow = ["JUMP", "JUMPIFEQ", "JUMPIFNEQ", "CALL", "RETURN", "EXIT"]
+
+def fuse_program(prg, code, typed = ()):
+	'''
+	Peephole pass, fuses each instruction with the next one into
+	a superinstruction, unless the first can jump or the second
+	is a LABEL or a jump target, so every entry point keeps its handler
+	The original handlers stay at their orders, a fused pair runs
+	the same handlers or getters, so error behavior is unchanged
+	Pairs with a check-free typed handler are only fused generically
+	'''
+	targets = {order + 1 for order, line in prg.items() if line['instr'] == 'LABEL'}
+	targets.update(order + 1 for order, line in prg.items() if line['instr'] == 'CALL')
+	special = dict()
+	for order, line in prg.items():
+		line2 = prg.get(order + 1)
+		if line2 is None or order + 1 in targets or order in typed or order + 1 in typed:
+			continue
+		builder = fused_table.get((line['instr'], line2['instr']))
+		if builder:
+			h = builder(line, line2, order)
+			if h:
+				special[order] = h
+	fused = dict(code)
+	for order, line in prg.items():
+		if order in special:
+			fused[order] = special[order]
+			continue
+		line2 = prg.get(order + 1)
+		if line2 is None or order + 1 in targets or line['instr'] in opcodes_flow or line2['instr'] == 'LABEL':
+			continue
+		if order + 1 in special:
+			# leave the next one to start its superinstruction
+			continue
+		fused[order] = fuse_pair(code[order], code[order + 1])
+	return fused
+
+
+# longest basic block compiled into a single function
+block_maxlen = 256
+
+def block_frame(fid, name):
+	'''
+	Returns the condition that a frame exists and the expression for it
+	in generated block code, GF always exists
+	'''
+	if fid == GF:
+		return [], 'gf'
+	return [f"({name} := frames[{fid}]) is not None"], name
+
+def block_dest(arg, state):
+	'''
+	Returns the conditions that a destination variable is defined
+	and the expression to assign it in generated block code
+	'''
+	fid, slot = arg.ref
+	if state and proven_defined(state, arg):
+		return [], f"gf[{slot}]"
+	conds, frame = block_frame(fid, 'fd')
+	defined = f"{frame}[{slot}] is not undef" if fid == GF else f"{slot} in {frame}"
+	return conds + [defined], f"{frame}[{slot}]"
+
+def block_sym(arg, k, state, vtype = None):
+	'''
+	Returns the conditions under which reading a symbol succeeds
+	and expressions for its type and value in generated block code,
+	or None if the literal is of a type other than vtype
+	Variables of a type proven by infer_types need no conditions
+	'''
+	if arg.type != 'var':
+		if vtype and arg.ref[0] != vtype:
+			return None
+		return [], repr(arg.ref[0]), repr(arg.ref[1])
+	fid, slot = arg.ref
+	proven = proven_type(state, arg) if state else None
+	if proven not in [None, T_NIL] and (vtype is None or type_bits[vtype] == proven):
+		return [], repr(bit_types[proven]), f"gf[{slot}][1]"
+	conds, frame = block_frame(fid, f"f{k}")
+	value = f"{frame}[{slot}]" if fid == GF else f"{frame}.get({slot})"
+	conds.append(f"(v{k} := {value}).__class__ is asmval")
+	if vtype:
+		conds.append(f"v{k}[0] == {vtype!r}")
+	return conds, f"v{k}[0]", f"v{k}[1]"
+
+def block_static(conds):
+	'''
+	Drops conditions that only compare literals and are true
+	Returns None if one of them is false, the instruction then always fails
+	'''
+	dynamic = []
+	for cond in conds:
+		try:
+			value = eval(cond, {'__builtins__':{}})
+		except NameError:
+			dynamic.append(cond)
+			continue
+		if not value:
+			return None
+	return dynamic
+
+def block_fast(line, consts, state):
+	'''
+	Returns (conditions, statement) of the inlined fast path of a non-jumping
+	instruction or None if it only runs through its handler
+	The conditions hold exactly when the handler would not fail,
+	the statement then has the same effect as the handler
+	'''
+	instr = line['instr']
+	args = line['args']
+	vtypes = {"ADD":'int', "SUB":'int', "MUL":'int', "IDIV":'int',
+		"AND":'bool', "OR":'bool', "NOT":'bool', "STRLEN":'string'}
+	if instr in ["MOVE", "ADD", "SUB", "MUL", "IDIV", "LT", "GT", "EQ", "AND", "OR", "NOT", "GETCHAR", "STRI2INT", "STRLEN"]:
+		conds, dest = block_dest(args[0], state)
+		if instr in ["GETCHAR", "STRI2INT"]:
+			syms = [block_sym(args[1], 1, state, 'string'), block_sym(args[2], 2, state, 'int')]
+		else:
+			syms = [block_sym(arg, k, state, vtypes.get(instr)) for k, arg in enumerate(args[1:], 1)]
+		if None in syms:
+			return None
+		for symconds, _, _ in syms:
+			conds += symconds
+		vals = [val for _, _, val in syms]
+		if instr == "MOVE":
+			if args[1].type != 'var':
+				name = f"c{len(consts)}"
+				consts[name] = asmval(*args[1].ref)
+				return conds, f"{dest} = {name}"
+			if not syms[0][0] and syms[0][1] != repr('string'):
+				# proven not to be a string, so not a string buffer either
+				return conds, f"{dest} = gf[{args[1].ref[1]}]"
+			if not syms[0][0]:
+				return conds + [f"gf[{args[1].ref[1]}][1].__class__ is not asmstr"], f"{dest} = gf[{args[1].ref[1]}]"
+			return conds + ["v1[1].__class__ is not asmstr"], f"{dest} = v1"
+		if instr in arith_funcs:
+			return conds, f"{dest} = new(asmval, ('int', {vals[0]} {arith_ops[instr]} {vals[1]}))"
+		if instr == "IDIV":
+			return conds + [f"{vals[1]} != 0"], f"{dest} = new(asmval, ('int', {vals[0]} // {vals[1]}))"
+		if instr in cmp_funcs:
+			conds += [f"{syms[0][1]} == {syms[1][1]}", f"{syms[0][1]} != 'nil'"]
+			return conds, f"{dest} = bool_vals[{vals[0]} {cmp_ops[instr]} {vals[1]}]"
+		if instr == "NOT":
+			return conds, f"{dest} = bool_vals[not {vals[0]}]"
+		if instr in ["AND", "OR"]:
+			return conds, f"{dest} = bool_vals[{vals[0]} {'&' if instr == 'AND' else '|'} {vals[1]}]"
+		if instr == "STRLEN":
+			return conds, f"{dest} = new(asmval, ('int', len({vals[0]})))"
+		conds.append(f"0 <= {vals[1]} < len({vals[0]})")
+		if instr == "GETCHAR":
+			return conds, f"{dest} = new(asmval, ('string', {vals[0]}[{vals[1]}]))"
+		return conds, f"{dest} = new(asmval, ('int', ord({vals[0]}[{vals[1]}])))"
+	return None
+
+arith_ops = {'ADD':'+', 'SUB':'-', 'MUL':'*'}
+cmp_ops = {'LT':'<', 'GT':'>', 'EQ':'=='}
+
+def block_source(prg, orders, consts, states):
+	'''
+	Generates the python source of a basic block function
+	Instructions without a fast path, and those whose fast path
+	conditions fail, run their handler, which reports any error
+	'''
+	first = orders[0]
+	src = [f"def b{first}(st):",
+		"\tframes = st.frames",
+		"\tgf = frames[0]",
+		f"\tst.icnt += {len(orders)}"]
+	for order in orders:
+		line = prg[order]
+		instr = line['instr']
+		state = states.get(order)
+		src.append(f"\t# {order} {instr}")
+		if instr in ['LABEL', 'NOP']:
+			continue
+		if instr == 'JUMP':
+			src.append(f"\treturn {line['args'][0].ref[1] + 1}")
+			continue
+		if instr in opcodes_lss:
+			target = line['args'][0].ref[1] + 1
+			syms = [block_sym(line['args'][1], 1, state), block_sym(line['args'][2], 2, state)]
+			conds = block_static(syms[0][0] + syms[1][0] + [f"{syms[0][1]} == {syms[1][1]}"])
+			yes, no = (target, order + 1) if instr == 'JUMPIFEQ' else (order + 1, target)
+			if conds is None:
+				src.append(f"\treturn h{order}(st)")
+				continue
+			if conds:
+				src.append(f"\tif {' and '.join(conds)}:")
+				src.append(f"\t\treturn {yes} if {syms[0][2]} == {syms[1][2]} else {no}")
+				src.append(f"\treturn h{order}(st)")
 			else:
-				eprint(54, f"Attempted {instr} to undefined frame: {line['args'][0].val} at order {ip}")
-		elif instr == 'TYPE':
-			destpref, destname = line['args'][0].val.split('@')
-			destframe = fdd[destpref.upper()]
-			if destframe != None:
-				if destname in destframe:
-					srcpref, srcname = line['args'][1].val.split('@') if line['args'][1].type == 'var' else [line['args'][1].type, line['args'][1].val]
-					if srcpref in fdd:
-						# typechecking var
-						srcframe = fdd[srcpref]
-						if srcframe != None:
-							if srcname in srcframe:
-								if srcframe[srcname] != None:
-									destframe[destname] = {'type':'string', 'val':srcframe[srcname]['type']}
-								else:
-									destframe[destname] = {'type':'string', 'val':""}
-							else:
-								eprint(54, f"Attempted {instr} from undefined variable: {line['args'][1].val} at order {ip}")
-						else:
-							eprint(54, f"Attempted {instr} from undefined frame: {line['args'][1].val} at order {ip}")
-					else:
-						# typechecking literal
-						destframe[destname] = {'type':'string', 'val':srcpref}
-				else:
-					eprint(54, f"Attempted {instr} to undefined variable: {line['args'][0].val} at order {ip}")
+				src.append(f"\treturn {yes} if {syms[0][2]} == {syms[1][2]} else {no}")
+			continue
+		if instr in opcodes_flow or instr == 'BREAK':
+			src.append(f"\treturn h{order}(st)")
+			continue
+		fast = block_fast(line, consts, state)
+		conds = block_static(fast[0]) if fast else None
+		if conds is None:
+			src.append(f"\th{order}(st)")
+			continue
+		stmt = fast[1]
+		if conds:
+			src.append(f"\tif {' and '.join(conds)}:")
+			src.append(f"\t\t{stmt}")
+			src.append("\telse:")
+			src.append(f"\t\th{order}(st)")
+		else:
+			src.append(f"\t{stmt}")
+	if prg[orders[-1]]['instr'] not in opcodes_flow + ['BREAK']:
+		src.append(f"\treturn {orders[-1] + 1}")
+	return '\n'.join(src)
+
+def compile_blocks(prg, code, states):
+	'''
+	Splits the program into basic blocks, starting at the first
+	instruction, jump targets and after anything that can jump or BREAK,
+	and compiles each of them into a python function
+	A block function runs all its instructions and returns the order
+	of the next block, so the main loop dispatches once per block
+	BREAK ends a block, so it sees the exact instruction count
+	Operands of types proven by infer_types are used without checks
+	'''
+	leaders = {order + 1 for order, line in prg.items() if line['instr'] == 'LABEL'}
+	leaders.update(order + 1 for order, line in prg.items() if line['instr'] in opcodes_flow or line['instr'] == 'BREAK')
+	blocks = []
+	for order in sorted(prg):
+		# orders dropped by the optimizer also end a block
+		if not blocks or order in leaders or order != blocks[-1][-1] + 1 or len(blocks[-1]) >= block_maxlen:
+			blocks.append([])
+		blocks[-1].append(order)
+	consts = dict()
+	source = '\n\n'.join(block_source(prg, orders, consts, states) for orders in blocks)
+	namespace = {"asmval":asmval, "asmstr":asmstr, "undef":undef, "bool_vals":bool_vals, "new":tuple.__new__}
+	namespace.update(consts)
+	namespace.update((f"h{order}", h) for order, h in code.items())
+	exec(compile(source, "<ippcode22 blocks>", "exec"), namespace)
+	return {orders[0]: namespace[f"b{orders[0]}"] for orders in blocks}
+
+
+def run_profiled(code, st, ip, first, last):
+	'''
+	Main loop with per instruction execution counts and wall times
+	They are kept in st.profile as dicts keyed by order, so they are
+	there also when the program ends by EXIT or an error
+	'''
+	counts = dict.fromkeys(code, 0)
+	times = dict.fromkeys(code, 0.0)
+	st.profile = (counts, times)
+	clock = time.perf_counter
+	try:
+		while first <= ip <= last:
+			st.icnt += 1
+			counts[ip] += 1
+			start = clock()
+			nxt = code[ip](st)
+			times[ip] += clock() - start
+			ip = nxt
+	except BaseException:
+		# the instruction that ended the program still counts
+		times[ip] += clock() - start
+		raise
+
+def profile_data(prg, counts, times, icnt, walltime):
+	'''
+	Aggregates per order counts and times by opcode and by block,
+	a block runs from a LABEL (or the first instruction) up to the next LABEL
+	'''
+	opcodes = dict()
+	blocks = []
+	for order in sorted(counts):
+		instr = prg[order]['instr']
+		op = opcodes.setdefault(instr, {"count":0, "time":0.0})
+		op["count"] += counts[order]
+		op["time"] += times[order]
+		if instr == 'LABEL' or not blocks:
+			label = prg[order]['args'][0].val if instr == 'LABEL' else None
+			blocks.append({"label":label, "first":order, "last":order, "entries":counts[order], "count":0, "time":0.0})
+		elif order == blocks[-1]["first"] + 1 and blocks[-1]["label"] is not None:
+			# jumps land after the LABEL, entries are counted on the next instruction
+			blocks[-1]["entries"] = counts[order]
+		block = blocks[-1]
+		block["last"] = order
+		block["count"] += counts[order]
+		block["time"] += times[order]
+	return {
+		"instructions":icnt,
+		"wall_time":walltime,
+		"opcodes":opcodes,
+		"blocks":blocks,
+		"orders":{order: {"opcode":prg[order]['instr'], "count":counts[order], "time":times[order]} for order in sorted(counts)}}
+
+def profile_report(data, hot = 20):
+	'''
+	Formats profile_data as text, sorted by time spent
+	'''
+	total = sum(op["time"] for op in data["opcodes"].values()) or 1.0
+	lines = ['###### PROFILE ######',
+		f'instr count = {data["instructions"]}',
+		f'wall time = {data["wall_time"]:.6f} s',
+		'### opcodes ###',
+		f'{"opcode":<12}{"count":>12}{"time [s]":>12}{"time %":>8}']
+	for name, op in sorted(data["opcodes"].items(), key=lambda i: -i[1]["time"]):
+		lines.append(f'{name:<12}{op["count"]:>12}{op["time"]:>12.6f}{100 * op["time"] / total:>8.2f}')
+	lines.append('### blocks ###')
+	lines.append(f'{"label":<20}{"orders":>14}{"entries":>10}{"count":>12}{"time [s]":>12}{"time %":>8}')
+	for block in sorted(data["blocks"], key=lambda b: -b["time"]):
+		label = '<start>' if block["label"] is None else block["label"]
+		orders = f'{block["first"]}-{block["last"]}'
+		lines.append(f'{label:<20}{orders:>14}{block["entries"]:>10}{block["count"]:>12}{block["time"]:>12.6f}{100 * block["time"] / total:>8.2f}')
+	lines.append(f'### hottest {hot} instructions ###')
+	lines.append(f'{"order":>8} {"opcode":<12}{"count":>12}{"time [s]":>12}{"time %":>8}')
+	for order, line in sorted(data["orders"].items(), key=lambda i: -i[1]["time"])[:hot]:
+		lines.append(f'{order:>8} {line["opcode"]:<12}{line["count"]:>12}{line["time"]:>12.6f}{100 * line["time"] / total:>8.2f}')
+	lines.append('###### end of PROFILE ######')
+	return '\n'.join(lines)
+
+def profile_emit(prg, counts, times, icnt, walltime, json_fname):
+	'''
+	Prints the profile report to stderr and optionally writes it as json
+	'''
+	data = profile_data(prg, counts, times, icnt, walltime)
+	print(profile_report(data), file=sys.stderr)
+	if json_fname:
+		try:
+			with open(json_fname, 'w') as f:
+				json.dump(data, f, indent=1)
+		except OSError as e:
+			print(f"Warning: could not write profile: {e}", file=sys.stderr)
+
+
+class asmprogram():
+	'''
+	Loaded and checked program, compiled once and run any number of times
+	Each run gets fresh frames, stacks and output buffer, so runs
+	don't affect each other, errors are raised as asmerror
+	'''
+	def __init__(self):
+		self.prg = dict()
+		self.labeldict = dict()
+		self.labels_jumped = set()
+		self.vardict = {'GF':dict(), 'LF':dict()}
+		self.orderlist = []
+		self.orderset = set()
+		self.orderdupes = set()
+		self.code = None
+		# decodes the instruction of an order that prg does not have yet,
+		# set while a lazily loaded program is not fully decoded
+		self.decoder = None
+
+	@classmethod
+	def load(cls, source, text = False, lazy = False):
+		'''
+		Loads and checks a program from a file name or binary file object,
+		of xml or if text is set IPPcode22 source
+		lazy defers decoding xml args until the instructions first run
+		'''
+		program = cls()
+		analyze(program, source, text, lazy)
+		return program
+
+	def line(self, order):
+		'''
+		Returns the instruction of order, decoding it on first use
+		'''
+		line = self.prg.get(order)
+		if line is None:
+			line = self.prg[order] = self.decoder(order)
+		return line
+
+	def decode_all(self):
+		'''
+		Decodes the instructions a lazily loaded program has not decoded yet,
+		the passes over the whole program need all of them
+		'''
+		if self.decoder is None:
+			return
+		self.prg = {order: self.line(order) for order in self.orderlist}
+		self.orderlist = list(self.orderlist)
+		self.orderset = set(self.orderlist)
+		self.decoder = None
+
+	def optimize(self):
+		'''
+		Runs optimize_program, returns its report
+		'''
+		self.decode_all()
+		self.code = None
+		return optimize_program(self.prg, self.vardict)
+
+	def compile(self, fusion = True, blocks = False, typing = True, profile = False):
+		'''
+		Compiles the handlers the runs use,
+		the args match --no-fusion, --blocks, --no-types and --profile
+		A lazily loaded program compiles each instruction when it first runs,
+		without fusion and types, unless blocks or profile need all of them
+		'''
+		if self.decoder is not None and not (blocks or profile):
+			self.first, self.last = self.orderlist.start, self.orderlist.stop - 1
+			self.profile = self.blocks = False
+			self.code = self.steps = asmlazycode(self)
+			return
+		self.decode_all()
+		code = compile_program(self.prg)
+		states = infer_types(self.prg, self.vardict) if typing else dict()
+		typed = specialize_program(self.prg, code, states)
+		# the order bounds are fixed once the program is loaded
+		# an empty program has nothing to run
+		self.first, self.last = (min(self.orderlist), max(self.orderlist)) if self.orderlist else (1, 0)
+		# single instruction handlers, a resumed run may start inside a block
+		self.steps = dense_code(code, self.first, self.last)
+		# profile counts have to map to single instructions
+		if blocks and not profile:
+			code = compile_blocks(self.prg, code, states)
+		elif fusion and not profile:
+			code = fuse_program(self.prg, code, typed)
+		self.profile = profile
+		self.blocks = blocks and not profile
+		self.code = code if profile else dense_code(code, self.first, self.last)
+
+	def execute(self, st, ip = None, checkpoint = None):
+		'''
+		Runs the program on the machine state st from order ip,
+		the first one by default, returns the exit code
+		checkpoint is the asmcheckpoint to write periodically or None
+		'''
+		if self.code is None:
+			self.compile()
+		code = self.code
+		if ip is None:
+			ip = self.first
+		last = self.last
+		# main loop
+		#  (づ｡◕ヮ◕｡)づ wavy code so pretty
+		try:
+			if self.blocks:
+				# run up to the start of the next block
+				while ip <= last and code[ip] is None:
+					st.icnt += 1
+					ip = self.steps[ip](st)
+			if self.profile:
+				run_profiled(code, st, ip, self.first, last)
+			elif checkpoint is not None:
+				run_checkpointed(code, st, ip, last, not self.blocks, checkpoint)
+			elif self.blocks:
+				# blocks count their instructions themselves
+				while ip <= last:
+					ip = code[ip](st)
 			else:
-				eprint(54, f"Attempted {instr} to undefined frame: {line['args'][0].val} at order {ip}")
-		elif instr == 'LABEL':
-			# do nothing
-			None
-		elif instr == 'JUMP':
-			ip = labeldict[line['args'][0].val]
-		elif instr == 'JUMPIFEQ':
-			ip = labeldict[line['args'][0].val] if is_2_3_eql(line, fdd) else ip
-		elif instr == 'JUMPIFNEQ':
-			ip = labeldict[line['args'][0].val] if not is_2_3_eql(line, fdd) else ip
-		elif instr == 'EXIT':
-			srcpref, srcname = line['args'][0].val.split('@') if line['args'][0].type == 'var' else [line['args'][0].type, line['args'][0].val]
-			if srcpref in fdd:
-				# exit with var
-				srcframe = fdd[srcpref]
-				if srcframe != None:
-					if srcname in srcframe:
-						if srcframe[srcname] != None:
-							print(srcframe[srcname]['val'], end='')
-							if srcframe[srcname]['type'] == 'int':
-								out = srcframe[srcname]['val']
-								if out in range(50):
-									exit(out)
-								else:
-									eprint(57, f"Invalid EXIT code at order {ip}")
-							else:
-								eprint(54, f"Attempted {instr} with {srcframe[srcname]['type']} type variable: {line['args'][0].val} at order {ip}")
-						else:
-							eprint(54, f"Attempted {instr} from uninitialized variable: {line['args'][0].val} at order {ip}")
-					else:
-						eprint(54, f"Attempted {instr} from undefined variable: {line['args'][0].val} at order {ip}")
-				else:
-					eprint(54, f"Attempted {instr} from undefined frame: {line['args'][0].val} at order {ip}")
+				while ip <= last:
+					st.icnt += 1
+					ip = code[ip](st)
+		except asmexit as e:
+			return e.code
+		finally:
+			st.output.flush()
+		return 0
+
+	def run(self, input_stream = None, output_stream = None, error_stream = None, output_limit = output_bufsize):
+		'''
+		Runs the program with fresh frames and stacks, returns the exit code
+		READ reads the lines of input_stream, nil once there are none,
+		WRITE writes to output_stream, DPRINT and BREAK to error_stream,
+		sys.stdout and sys.stderr by default
+		'''
+		lines = (l.rstrip() for l in input_stream) if input_stream is not None else iter(())
+		st = asmstate(self.vardict, lines, output_stream or sys.stdout, error_stream or sys.stderr, output_limit)
+		return self.execute(st)
+
+class asmlazycode(dict):
+	'''
+	Handlers of a lazily loaded program by order,
+	an instruction is decoded and compiled when it first runs
+	'''
+	__slots__ = ('program',)
+
+	def __init__(self, program):
+		super().__init__()
+		self.program = program
+
+	def __missing__(self, order):
+		line = self.program.line(order)
+		h = self[order] = handler_table[line['instr']](line, order)
+		return h
+
+class asmcheckpoint():
+	'''
+	Periodic checkpoint of a running program, written every 'every'
+	instructions or, if seconds is set, every 'seconds' seconds
+	reads counts the input lines READ consumed, see count_lines
+	'''
+	__slots__ = ('path', 'every', 'seconds', 'deadline', 'digest', 'reads')
+
+	def __init__(self, path, every, seconds, digest):
+		self.path = path
+		self.seconds = seconds
+		# with a time interval the clock is checked every 'every' instructions
+		self.every = checkpoint_clock_every if seconds else every
+		self.deadline = time.monotonic() + seconds if seconds else None
+		self.digest = digest
+		self.reads = 0
+
+	def count_lines(self, lines):
+		'''
+		Passes the READ input lines through, counting them
+		'''
+		for l in lines:
+			self.reads += 1
+			yield l
+
+	def due(self):
+		if self.seconds is None:
+			return True
+		now = time.monotonic()
+		if now < self.deadline:
+			return False
+		self.deadline = now + self.seconds
+		return True
+
+	def write(self, st, ip):
+		'''
+		Writes the machine state before order ip, see checkpoint_pack
+		'''
+		st.output.flush()
+		try:
+			st.stdout.flush()
+			offset = st.stdout.tell()
+		except (OSError, ValueError, AttributeError):
+			# not a regular file, output after the checkpoint is not undone on resume
+			offset = None
+		data = checkpoint_pack(st, ip, self.digest, self.reads, offset)
+		tmp = f"{self.path}.{os.getpid()}.tmp"
+		try:
+			with open(tmp, 'wb') as f:
+				f.write(marshal.dumps(data))
+			os.replace(tmp, self.path)
+		except OSError as e:
+			eprint(12, f"Failed writing checkpoint: {e}")
+
+# instructions run between clock checks of --checkpoint-every=<seconds>s
+checkpoint_clock_every = 65536
+
+def program_digest(program):
+	'''
+	Identifies the loaded program, a checkpoint only resumes the same one
+	'''
+	return hashlib.sha256(marshal.dumps(cache_pack(program))).hexdigest()
+
+def pack_slot(value):
+	'''
+	Plain data form of a variable slot or stack value,
+	0 for undefined, string buffers as their str
+	'''
+	if value is undef:
+		return 0
+	if value is None:
+		return None
+	return (value.type, str(value.val) if isinstance(value.val, asmstr) else value.val)
+
+def unpack_slot(value):
+	'''
+	Rebuilds a value packed by pack_slot
+	'''
+	if value == 0:
+		return undef
+	if value is None:
+		return None
+	vtype, val = value
+	if vtype == 'bool':
+		return bool_vals[val]
+	if vtype == 'nil':
+		return nil_val
+	return asmval(vtype, val)
+
+def pack_frame(frame):
+	'''
+	Plain data form of a frame, see pack_slot
+	GF stays a list, LF and TF frames a dict
+	'''
+	if frame is None:
+		return None
+	if isinstance(frame, dict):
+		return {slot: pack_slot(v) for slot, v in frame.items()}
+	return [pack_slot(v) for v in frame]
+
+def unpack_frame(frame):
+	'''
+	Rebuilds a frame packed by pack_frame
+	'''
+	if frame is None:
+		return None
+	if isinstance(frame, dict):
+		return {slot: unpack_slot(v) for slot, v in frame.items()}
+	return [unpack_slot(v) for v in frame]
+
+def checkpoint_pack(st, ip, digest, reads, offset):
+	'''
+	Returns the machine state as plain data that marshal can store
+	LF is not stored, it is always the top of the frame stack
+	'''
+	return (interpreter_version, digest, ip, st.icnt, pack_frame(st.frames[GF]),
+		[pack_frame(f) for f in st.framestack], pack_frame(st.frames[TF]),
+		[pack_slot(v) for v in st.datastack], list(st.callstack), reads, offset)
+
+def checkpoint_load(path, digest):
+	'''
+	Reads a checkpoint written by asmcheckpoint, checking it belongs to the program
+	'''
+	try:
+		with open(path, 'rb') as f:
+			data = marshal.loads(f.read())
+		version, saved_digest = data[:2]
+	except (OSError, EOFError, ValueError, TypeError) as e:
+		eprint(11, f"Failed reading checkpoint: {e}")
+	if version != interpreter_version or saved_digest != digest:
+		eprint(11, "Checkpoint was written for another program or interpreter version")
+	return data
+
+def checkpoint_restore(st, data):
+	'''
+	Puts a loaded checkpoint into the fresh machine state st
+	Skips the input lines READ already consumed and, if stdout is a regular
+	file, drops the output written after the checkpoint was taken
+	Returns (order to continue at, consumed input lines)
+	'''
+	_, _, ip, icnt, gf, framestack, tf, datastack, callstack, reads, offset = data
+	st.icnt = icnt
+	st.frames[GF] = unpack_frame(gf)
+	st.framestack[:] = [unpack_frame(f) for f in framestack]
+	st.frames[LF] = st.framestack[-1] if st.framestack else None
+	st.frames[TF] = unpack_frame(tf)
+	st.datastack[:] = [unpack_slot(v) for v in datastack]
+	st.callstack[:] = callstack
+	for _ in range(reads):
+		next(st.read_lines, None)
+	if offset is not None:
+		try:
+			st.stdout.flush()
+			# a file truncated since, not appended to, is left alone
+			if st.stdout.seek(0, os.SEEK_END) >= offset:
+				st.stdout.seek(offset)
+				st.stdout.truncate()
+		except (OSError, ValueError, AttributeError):
+			pass
+	return ip, reads
+
+def run_checkpointed(code, st, ip, last, counted, checkpoint):
+	'''
+	Main loop that writes a checkpoint between instructions, every
+	checkpoint.every instructions once checkpoint.due() says so
+	counted is False for blocks, which count their instructions themselves
+	'''
+	every = checkpoint.every
+	while ip <= last:
+		stop = st.icnt + every
+		if counted:
+			while ip <= last and st.icnt < stop:
+				st.icnt += 1
+				ip = code[ip](st)
+		else:
+			while ip <= last and st.icnt < stop:
+				ip = code[ip](st)
+		if ip <= last and checkpoint.due():
+			checkpoint.write(st, ip)
+
+# program and output buffer size of a --batch worker process, see batch_init
+batch_worker = None
+
+def batch_init(source, cpath, optimize, options, output_limit, freeze = True):
+	'''
+	Loads and compiles the program once per --batch worker
+	source is the (source, text) pair, see asmprogram.load,
+	or the name of a bytecode file, cpath the cache file or None
+	freeze keeps the program out of later collections, see run_cli
+	'''
+	global batch_worker
+	gc.disable()
+	try:
+		program = cache_load(cpath) if cpath else None
+		if isinstance(source, str):
+			program = bytecode_load(source)
+		elif program is None:
+			program = asmprogram.load(io.BytesIO(source[0]), source[1])
+		if optimize:
+			program.optimize()
+		program.compile(*options)
+		batch_worker = (program, output_limit)
+		if freeze:
+			gc.freeze()
+	finally:
+		gc.enable()
+
+def batch_run(input_fname):
+	'''
+	Runs the worker's program on one input file
+	Returns (input file, exit code, stdout, stderr, wall time)
+	Errors of the program end only its run, with their code
+	'''
+	program, output_limit = batch_worker
+	out = io.StringIO()
+	err = io.StringIO()
+	start = time.perf_counter()
+	try:
+		with open(input_fname, 'r', buffering=input_bufsize) as f:
+			ecode = program.run(f, out, err, output_limit)
+	except asmerror as e:
+		print("Error:", e.msg, file=err)
+		ecode = e.code
+	except OSError as e:
+		print("Error: Failed opening or reading input file:", e, file=err)
+		ecode = 11
+	except Exception as e:
+		# a bug in the interpreter should not take the whole batch down
+		print("Error: Internal error:", repr(e), file=err)
+		ecode = 99
+	return input_fname, ecode, out.getvalue(), err.getvalue(), time.perf_counter() - start
+
+def batch_inputs(batch):
+	'''
+	Input files of a --batch run, the files of a directory
+	in name order or the lines of a manifest file, relative
+	paths in it are relative to its directory
+	'''
+	if os.path.isdir(batch):
+		return [os.path.join(batch, name) for name in sorted(os.listdir(batch)) if os.path.isfile(os.path.join(batch, name))]
+	base = os.path.dirname(batch)
+	try:
+		with open(batch) as f:
+			return [os.path.join(base, l.strip()) for l in f if l.strip()]
+	except OSError as e:
+		eprint(11, f"Failed opening or reading batch manifest: {e}")
+
+def run_batch(source, cpath, optimize, options, output_limit, inputs, jobs, out_dir, freeze = True):
+	'''
+	Runs the program on every input file on a pool of jobs processes,
+	each of them loads the program once, a single job runs in this process
+	and only freezes the program if freeze is set
+	Writes a json line per run to stdout, with the run's output, or if
+	out_dir is given, writes <input name>.out, .err and .rc there instead
+	'''
+	names = [os.path.basename(i) for i in inputs]
+	if out_dir is not None:
+		if len(set(names)) != len(names):
+			eprint(10, "Batch input files must have distinct names with --batch-out")
+		try:
+			os.makedirs(out_dir, exist_ok=True)
+		except OSError as e:
+			eprint(12, f"Failed creating batch output directory: {e}")
+	initargs = (source, cpath, optimize, options, output_limit)
+	jobs = min(jobs, len(inputs))
+	if jobs <= 1:
+		batch_init(*initargs, freeze)
+		results = map(batch_run, inputs)
+		pool = None
+	else:
+		# only batch runs pay for importing multiprocessing
+		import multiprocessing
+		pool = multiprocessing.Pool(jobs, batch_init, initargs)
+		results = pool.imap(batch_run, inputs, chunksize=max(1, len(inputs) // (jobs * 8)))
+	try:
+		for name, (input_fname, ecode, out, err, walltime) in zip(names, results):
+			record = {"input":input_fname, "exit_code":ecode, "time":walltime}
+			if out_dir is None:
+				record["stdout"] = out
+				record["stderr"] = err
 			else:
-				# exit with literal
-				if srcpref == 'int':
-					out = int(srcname, get_base(src_name))
-					if out in range(50):
-						exit(out)
-					else:
-						eprint(57, f"Invalid EXIT code at order {ip}")
-				else:
-					eprint(54, f"Attempted {instr} with {srcpref} type literal: {line['args'][0].val} at order {ip}")
-		elif instr == 'DPRINT':
-			srcpref, srcname = line['args'][0].val.split('@') if line['args'][0].type == 'var' else [line['args'][0].type, line['args'][0].val]
-			if srcpref in fdd:
-				# writing var
-				srcframe = fdd[srcpref]
-				if srcframe != None:
-					if srcname in srcframe:
-						if srcframe[srcname] != None:
-							print(srcframe[srcname]['val'], end='', file=sys.stderr)
-						else:
-							eprint(54, f"Attempted {instr} from uninitialized variable: {line['args'][0].val} at order {ip}")
-					else:
-						eprint(54, f"Attempted {instr} from undefined variable: {line['args'][0].val} at order {ip}")
-				else:
-					eprint(54, f"Attempted {instr} from undefined frame: {line['args'][0].val} at order {ip}")
+				base = os.path.join(out_dir, name)
+				try:
+					for ext, text in [('.out', out), ('.err', err), ('.rc', f"{ecode}\n")]:
+						with open(base + ext, 'w') as f:
+							f.write(text)
+				except OSError as e:
+					eprint(12, f"Failed writing batch output: {e}")
+			print(json.dumps(record))
+	finally:
+		if pool is not None:
+			pool.terminate()
+	sys.stdout.flush()
+
+
+####################################
+###############MAIN#################
+####################################
+
+
+def run_cli(argv, freeze = False):
+	'''
+	Runs the command line, returns the exit code of the program
+	freeze keeps the loaded program out of later collections with gc.freeze,
+	which is only right for a one-shot process, a frozen program is never freed
+	'''
+	read_fp = None
+	xml_fname = None
+	text = False
+	bytecode = False
+	emit_fname = None
+	lazy = False
+	cache = False
+	cache_dir = None
+	profile = False
+	profile_json = None
+	fusion = True
+	blocks = False
+	typing = True
+	optimize = False
+	optimize_report = False
+	output_limit = output_bufsize
+	batch = None
+	batch_out = None
+	checkpoint_fname = None
+	checkpoint_every = 60.0
+	checkpoint_seconds = True
+	resume = None
+	jobs = os.cpu_count() or 1
+	#print(argv)
+	
+	for a in argv:
+		if a[:6] == "--help":
+			printhelp()
+			exit(0)
+		if a[:8] == "--input=":
+			try:
+				read_fp = open(a[8:], 'r', buffering=input_bufsize)
+			except:
+				pass
+		if a[:9] == "--source=":
+			xml_fname = a[9:]
+			text = bytecode = False
+		if a[:14] == "--source-text=":
+			xml_fname = a[14:]
+			text = True
+			bytecode = False
+		if a[:18] == "--source-bytecode=":
+			xml_fname = a[18:]
+			text = False
+			bytecode = True
+		if a == "--lazy":
+			lazy = True
+		if a[:16] == "--emit-bytecode=":
+			emit_fname = a[16:]
+		if a == "--cache":
+			cache = True
+		if a == "--no-cache":
+			cache = False
+		if a[:12] == "--cache-dir=":
+			cache_dir = a[12:]
+		if a == "--blocks":
+			blocks = True
+		if a == "--optimize":
+			optimize = True
+		if a == "--optimize-report":
+			optimize = True
+			optimize_report = True
+		if a == "--no-types":
+			typing = False
+		if a == "--no-fusion":
+			fusion = False
+		if a == "--profile":
+			profile = True
+		if a[:15] == "--profile-json=":
+			profile = True
+			profile_json = a[15:]
+		if a[:8] == "--batch=":
+			batch = a[8:]
+		if a[:12] == "--batch-out=":
+			batch_out = a[12:]
+		if a[:13] == "--checkpoint=":
+			checkpoint_fname = a[13:]
+		if a[:19] == "--checkpoint-every=":
+			every = a[19:]
+			checkpoint_seconds = every[-1:] == 's'
+			try:
+				checkpoint_every = float(every[:-1]) if checkpoint_seconds else int(every)
+			except ValueError:
+				checkpoint_every = 0
+			if checkpoint_every <= 0:
+				eprint(10, f"Invalid checkpoint interval: {every}")
+		if a[:9] == "--resume=":
+			resume = a[9:]
+		if a[:7] == "--jobs=":
+			try:
+				jobs = int(a[7:])
+			except ValueError:
+				jobs = 0
+			if jobs < 1:
+				eprint(10, f"Invalid number of jobs: {a[7:]}")
+		if a[:16] == "--output-buffer=":
+			try:
+				output_limit = int(a[16:])
+			except ValueError:
+				eprint(10, f"Invalid output buffer size: {a[16:]}")
+
+	if (checkpoint_fname or resume) and (profile or batch is not None):
+		eprint(10, "--checkpoint and --resume can not be combined with --profile or --batch")
+	if batch is not None:
+		if profile or read_fp:
+			eprint(10, "--batch can not be combined with --input or --profile")
+	elif not (read_fp or xml_fname):
+		eprint(10, "At least one of --input, --source, --source-text or --source-bytecode must be specified")
+
+	#print("Opening file...")
+	# loading and compiling only create acyclic objects, collecting during it is wasted work
+	gc.disable()
+	try:
+		cpath = None
+		if bytecode:
+			# bytecode needs no cache, batch workers map the same file
+			program = bytecode_load(xml_fname)
+			source = xml_fname
+		else:
+			if (cache or batch is not None) and xml_fname:
+				try:
+					with open(xml_fname, 'rb') as f:
+						source = f.read()
+				except FileNotFoundError:
+					eprint(31, "XML file not found")
+				except OSError as e:
+					eprint(31, f"Failed opening or reading xml file: {e}")
+			elif batch is not None:
+				source = sys.stdin.buffer.read()
+			if cache and xml_fname:
+				if cache_dir is None:
+					cache_dir = os.path.join(os.path.dirname(xml_fname), cache_dirname)
+				cpath = cache_path(cache_dir, source, text)
+				program = cache_load(cpath)
+				if program is None:
+					program = asmprogram.load(io.BytesIO(source), text)
+					cache_store(cpath, program)
+			elif batch is not None:
+				program = asmprogram.load(io.BytesIO(source), text)
 			else:
-				# writing literal
-				print(srcname, end='', file=sys.stderr)
-		elif instr == 'BREAK':
-			print('###### BREAK instr ######', file=sys.stderr)
-			print(f'ip = {ip}', file=sys.stderr)
-			print(f'instr count = {icnt}', file=sys.stderr)
-			print('### framestack ###', file=sys.stderr)
-			print(pprint.pformat(framestack), file=sys.stderr)
-			print('### GF ###', file=sys.stderr)
-			print(pprint.pformat(gf), file=sys.stderr)
-			print('### LF ###', file=sys.stderr)
-			print(pprint.pformat(lf), file=sys.stderr)
-			print('### TF ###', file=sys.stderr)
-			print(pprint.pformat(tf), file=sys.stderr)
-			print('### datastack ###', file=sys.stderr)
-			print(pprint.pformat(datastack), file=sys.stderr)
-			print('### callstack ###', file=sys.stderr)
-			print(pprint.pformat(callstack), file=sys.stderr)
-			print('###### end of BREAK instr ######', file=sys.stderr)
-			
-		ip += 1
-	#pprint.pp(gf)
-	labeldict = dict()
-	labels_jumped = set()
-	prg = dict()
-	vardict = dict()
-	orderlist = []
+				program = asmprogram.load(xml_fname if xml_fname else sys.stdin.buffer, text, lazy)
+			if batch is not None:
+				source = (source, text)
+		if not emit_fname and batch is None:
+			# checkpoints identify the program as loaded, before any optimization
+			digest = program_digest(program) if checkpoint_fname or resume else None
+			if optimize:
+				report = program.optimize()
+				if optimize_report:
+					print('\n'.join(['###### OPTIMIZER ######'] + report + ['###### end of OPTIMIZER ######']), file=sys.stderr)
+			program.compile(fusion, blocks, typing, profile)
+			# keep the loaded program out of later collections
+			if freeze:
+				gc.freeze()
+	finally:
+		gc.enable()
+	if emit_fname:
+		# the program as loaded, --optimize applies when it is run
+		bytecode_store(emit_fname, program)
+		return 0
+	if batch is not None:
+		# the program is checked here, so its errors are reported once,
+		# the workers load it again from the xml or the cache
+		inputs = batch_inputs(batch)
+		run_batch(source, cpath, optimize, (fusion, blocks, typing), output_limit, inputs, jobs, batch_out, freeze)
+		return 0
+	st = asmstate(program.vardict, read_lines(read_fp), sys.stdout, sys.stderr, output_limit)
+	ip = None
+	reads = 0
+	if resume:
+		ip, reads = checkpoint_restore(st, checkpoint_load(resume, digest))
+	checkpoint = None
+	if checkpoint_fname:
+		checkpoint = asmcheckpoint(checkpoint_fname, checkpoint_every, checkpoint_every if checkpoint_seconds else None, digest)
+		checkpoint.reads = reads
+		st.read_lines = checkpoint.count_lines(st.read_lines)
+	start = time.perf_counter()
+	try:
+		ecode = program.execute(st, ip, checkpoint)
+		# a finished program is not resumed
+		if checkpoint_fname:
+			try:
+				os.remove(checkpoint_fname)
+			except OSError:
+				pass
+		return ecode
+	finally:
+		if st.profile:
+			profile_emit(program.prg, *st.profile, st.icnt, time.perf_counter() - start, profile_json)
+		st.read_lines.close()
+
+def main(argv, freeze = False):
+	'''
+	Runs the command line, exits with the error code of an error
+	or the code of EXIT, for freeze see run_cli
+	'''
+	try:
+		ecode = run_cli(argv, freeze)
+	except asmerror as e:
+		print("Error:", e.msg, file=sys.stderr)
+		exit(e.code)
+	if ecode:
+		exit(ecode)
 
 if __name__ == "__main__":
-	main(sys.argv)
+	main(sys.argv, freeze = True)
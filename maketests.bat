@@ -4,3 +4,16 @@ php parse.php <test/helloworld.txt >test/helloworld.xml
 php parse.php <test/lfsr.txt >test/lfsr.xml
 php parse.php <test/str_inv.txt >test/str_inv.xml
 php parse.php <test/turing.txt >test/turing.xml
+php parse.php <test/int2char_bool.txt >test/int2char_bool.xml
+php parse.php <test/int2char_overflow.txt >test/int2char_overflow.xml
+php parse.php <test/int2char_range.txt >test/int2char_range.xml
+php parse.php <test/write_nil.txt >test/write_nil.xml
+php parse.php <test/read_eof.txt >test/read_eof.xml
+php parse.php <test/text_add_string.txt >test/text_add_string.xml
+php parse.php <test/text_read_type.txt >test/text_read_type.xml
+php parse.php <test/text_syntax.txt >test/text_syntax.xml
+php parse.php <test/pattern_mismatch.txt >test/pattern_mismatch.xml
+php parse.php <test/bad_escape.txt >test/bad_escape.xml
+php parse.php <test/checkpoint.txt >test/checkpoint.xml
+php parse.php <test/int_literal.txt >test/int_literal.xml
+php parse.php <test/label_redefinition.txt >test/label_redefinition.xml
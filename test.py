@@ -1,23 +1,308 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 
-import interpret
+####################################
+######GLOBALS AND CONSTANTS#########
+####################################
 
-prgs = [
-	"fibonacci",
-	"helloworld",
-	"turing",
-	"lfsr"
+# every test program is test/<name>.out, the stdout it has to write, and the program itself:
+# test/<name>.txt is its IPPcode22 source, test/<name>.xml what parse.php writes from it (see maketests.bat)
+# a program parse.php rejects has no .xml, one that can not be written in IPPcode22 has no .txt
+# test/<name>.rc is the exit code it has to end with, 0 if there is none
+# test/<name>.err, if there is one, has to be part of its stderr
+# READ reads test/<name>.in, or test/input.txt if there is none
+
+here = os.path.dirname(os.path.abspath(__file__))
+interpreter = os.path.join(here, 'interpret.py')
+testdir = os.path.join(here, 'test')
+inputfile = os.path.join(testdir, 'input.txt')
+
+# the interpreter writes utf-8 whatever the locale is
+env = dict(os.environ, PYTHONIOENCODING = 'utf-8')
+
+
+####################################
+############FUNCTIONS###############
+####################################
+
+def test_path(name, ext):
+	return os.path.join(testdir, name + ext)
+
+def input_path(name):
+	path = test_path(name, '.in')
+	return path if os.path.exists(path) else inputfile
+
+def read_file(path, default):
+	if not os.path.exists(path):
+		return default
+	with open(path, 'rb') as f:
+		return f.read()
+
+def run(args, stdin = b''):
+	'''
+	Runs the interpreter, returns (exit code, stdout, stderr)
+	'''
+	proc = subprocess.run([sys.executable, interpreter, *args], input=stdin, capture_output=True, env=env)
+	return proc.returncode, proc.stdout, proc.stderr
+
+def run_xml(name, tmpdir, options):
+	return [run([f"--source={test_path(name, '.xml')}", f"--input={input_path(name)}", *options])]
+
+def run_text(name, tmpdir, options):
+	return [run([f"--source-text={test_path(name, '.txt')}", f"--input={input_path(name)}", *options])]
+
+def run_stdin(name, tmpdir, options):
+	'''
+	The program is read from stdin
+	'''
+	return [run([f"--input={input_path(name)}", *options], read_file(test_path(name, '.xml'), b''))]
+
+def run_stdin_input(name, tmpdir, options):
+	'''
+	READ reads stdin
+	'''
+	return [run([f"--source={test_path(name, '.xml')}", *options], read_file(input_path(name), b''))]
+
+def run_cache(name, tmpdir, options):
+	'''
+	Runs twice with --cache, the second run loads what the first one cached
+	'''
+	args = [f"--source={test_path(name, '.xml')}", f"--input={input_path(name)}", "--cache", f"--cache-dir={tmpdir}", *options]
+	return [run(args), run(args)]
+
+def run_bytecode(name, tmpdir, options):
+	'''
+	Writes the program as bytecode and runs that
+	'''
+	bytecode = os.path.join(tmpdir, name + '.ippc')
+	result = run([f"--source={test_path(name, '.xml')}", f"--emit-bytecode={bytecode}"])
+	if result[0] != 0:
+		return [result]
+	return [run([f"--source-bytecode={bytecode}", f"--input={input_path(name)}", *options])]
+
+def run_checkpoint(name, tmpdir, options):
+	checkpoint = os.path.join(tmpdir, name + '.ckpt')
+	return run_xml(name, tmpdir, [f"--checkpoint={checkpoint}", "--checkpoint-every=100", *options])
+
+def run_batch(name, tmpdir, options):
+	'''
+	Runs the program over a manifest listing its input twice, one result per record
+	'''
+	manifest = os.path.join(tmpdir, name + '.batch')
+	with open(manifest, 'w') as f:
+		f.write(f"{input_path(name)}\n{input_path(name)}\n")
+	ecode, out, err = run([f"--source={test_path(name, '.xml')}", f"--batch={manifest}", *options])
+	if ecode != 0 or not out:
+		# the program failed to load, there are no records
+		return [(ecode, out, err)]
+	records = [json.loads(l) for l in out.decode().splitlines()]
+	return [(r["exit_code"], r["stdout"].encode(), err + r["stderr"].encode()) for r in records]
+
+# (label, runner, options) of the modes every program with an .xml runs in
+xml_modes = [
+	("default", run_xml, []),
+	("--no-fusion", run_xml, ["--no-fusion"]),
+	("--no-types", run_xml, ["--no-types", "--no-fusion"]),
+	("--blocks", run_xml, ["--blocks"]),
+	("--optimize", run_xml, ["--optimize"]),
+	("--optimize --blocks", run_xml, ["--optimize", "--blocks"]),
+	("--lazy", run_xml, ["--lazy"]),
+	("--output-buffer=0", run_xml, ["--output-buffer=0"]),
+	("--profile", run_xml, ["--profile"]),
+	("stdin", run_stdin, []),
+	("stdin input", run_stdin_input, []),
+	("--cache", run_cache, []),
+	("--source-bytecode", run_bytecode, []),
+	("--source-bytecode --blocks", run_bytecode, ["--blocks"]),
+	("--checkpoint", run_checkpoint, []),
+	("--batch", run_batch, ["--jobs=2"]),
 	]
 
-iprgs = [
-	"echo",
-	"str_inv"
+# modes every program with a .txt runs in
+text_modes = [
+	("--source-text", run_text, []),
 	]
 
-for p in prgs:
-	print(f'\n\nRunning {p}')
-	interpret.main([f"--source=test/{p}.xml"])
+def check_result(result, expected):
+	'''
+	Differences of a result from the expected one, as a list of strings
+	'''
+	ecode, out, err = result
+	exp_ecode, exp_out, exp_err = expected
+	problems = []
+	if ecode != exp_ecode:
+		problems.append(f"exit code {ecode}, expected {exp_ecode}")
+	# windows writes \r\n
+	if out.replace(b'\r\n', b'\n') != exp_out.replace(b'\r\n', b'\n'):
+		problems.append("stdout differs")
+	if exp_err not in err:
+		problems.append(f"stderr lacks {exp_err.decode().strip()!r}")
+	if problems and err.strip():
+		problems.append(f"stderr: {err.decode(errors='replace').strip().splitlines()[-1]}")
+	return problems
+
+def check_program(name):
+	'''
+	Runs a program in every mode it can run in, returns the failures
+	'''
+	expected = (
+		int(read_file(test_path(name, '.rc'), b'0')),
+		read_file(test_path(name, '.out'), b''),
+		read_file(test_path(name, '.err'), b'').strip(),
+		)
+	modes = []
+	if os.path.exists(test_path(name, '.xml')):
+		modes += xml_modes
+	if os.path.exists(test_path(name, '.txt')):
+		modes += text_modes
+	if not modes:
+		return [f"{name}: no .xml nor .txt"]
+	failures = []
+	with tempfile.TemporaryDirectory() as tmpdir:
+		for label, runner, options in modes:
+			for result in runner(name, tmpdir, options):
+				problems = check_result(result, expected)
+				if problems:
+					failures.append(f"{name} [{label}]: {', '.join(problems)}")
+	return failures
+
+def check_batch_manifest():
+	'''
+	Relative paths in a --batch manifest are relative to its directory, not the cwd
+	'''
+	with tempfile.TemporaryDirectory() as tmpdir:
+		os.mkdir(os.path.join(tmpdir, 'inputs'))
+		for name in ('a.txt', 'b.txt'):
+			with open(os.path.join(tmpdir, 'inputs', name), 'wb') as f:
+				f.write(read_file(inputfile, b''))
+		manifest = os.path.join(tmpdir, 'manifest')
+		with open(manifest, 'w') as f:
+			f.write("inputs/a.txt\n" + os.path.join(tmpdir, 'inputs', 'b.txt') + "\n")
+		ecode, out, err = run([f"--source={test_path('echo', '.xml')}", f"--batch={manifest}"])
+	records = [json.loads(l) for l in out.decode().splitlines()] if ecode == 0 else []
+	expected = read_file(test_path('echo', '.out'), b'').decode()
+	if len(records) != 2 or any(r["exit_code"] != 0 or r["stdout"] != expected for r in records):
+		return [f"batch manifest: exit code {ecode}, record exit codes {[r['exit_code'] for r in records]}, stderr: {err.decode(errors='replace').strip()}"]
+	return []
+
+def check_checkpoint_resume():
+	'''
+	A program resumed from the last checkpoint of a failed run ends as an uninterrupted run,
+	the output after the checkpoint is written once and READ goes on with the next line
+	and a checkpoint of another program is refused
+	'''
+	name = 'checkpoint'
+	expected = read_file(test_path(name, '.out'), b'')
+	source = [f"--source={test_path(name, '.xml')}", f"--input={input_path(name)}"]
+	failures = []
+	with tempfile.TemporaryDirectory() as tmpdir:
+		checkpoint = os.path.join(tmpdir, 'ckpt')
+		output = os.path.join(tmpdir, 'out')
+		results = []
+		# stdout is a file, so the resumed run drops what was written after the checkpoint
+		for args, mode in ((["--checkpoint=" + checkpoint, "--checkpoint-every=100"], 'wb'), (["--resume=" + checkpoint], 'ab')):
+			with open(output, mode) as f:
+				proc = subprocess.run([sys.executable, interpreter, *source, *args], stdin=subprocess.DEVNULL, stdout=f, stderr=subprocess.PIPE, env=env)
+			results.append(proc.returncode)
+			if not os.path.exists(checkpoint):
+				failures.append(f"checkpoint: no checkpoint left after a run ending with {proc.returncode}")
+				return failures
+		if results != [57, 57]:
+			failures.append(f"checkpoint: exit codes {results}, expected [57, 57]")
+		if read_file(output, b'').replace(b'\r\n', b'\n') != expected.replace(b'\r\n', b'\n'):
+			failures.append("checkpoint: resumed output differs")
+		ecode, out, err = run([f"--source={test_path('echo', '.xml')}", "--resume=" + checkpoint])
+		if ecode != 11:
+			failures.append(f"checkpoint: resuming another program ended with {ecode}, expected 11")
+	return failures
+
+def check_bytecode_errors():
+	'''
+	A damaged or truncated bytecode file ends with 31, a missing one with 11
+	'''
+	failures = []
+	with tempfile.TemporaryDirectory() as tmpdir:
+		bytecode = os.path.join(tmpdir, 'fibonacci.ippc')
+		run([f"--source={test_path('fibonacci', '.xml')}", f"--emit-bytecode={bytecode}"])
+		data = read_file(bytecode, b'')
+		damaged = []
+		# a flipped byte in the header, the first record, the constant pool, the string table and the chunk checksums
+		for at in (8, 40, len(data) // 2, len(data) - 20, len(data) - 1):
+			flipped = bytearray(data)
+			flipped[at] ^= 0x10
+			damaged.append((f"byte {at} flipped", flipped))
+		damaged += [("truncated", data[:-1]), ("empty", b''), ("not bytecode", read_file(test_path('fibonacci', '.xml'), b''))]
+		for label, content in damaged:
+			with open(bytecode, 'wb') as f:
+				f.write(content)
+			ecode, out, err = run([f"--source-bytecode={bytecode}", f"--input={inputfile}"])
+			if ecode != 31:
+				failures.append(f"bytecode {label}: exit code {ecode}, expected 31")
+		ecode, out, err = run([f"--source-bytecode={os.path.join(tmpdir, 'missing.ippc')}"])
+		if ecode != 11:
+			failures.append(f"bytecode missing: exit code {ecode}, expected 11")
+	return failures
+
+def check_lazy_errors():
+	'''
+	--lazy reports a bad arg only when its instruction runs, after the output before it,
+	the other modes before running anything, bad labels are reported up front in both
+	'''
+	program = '<?xml version="1.0" encoding="UTF-8"?>\n<program language="IPPcode22">\n{}</program>\n'
+	write = '<instruction order="{}" opcode="WRITE"><arg1 type="string">ok</arg1></instruction>\n'
+	exit = '<instruction order="{}" opcode="EXIT"><arg1 type="int">0</arg1></instruction>\n'
+	bad_int = '<instruction order="{}" opcode="WRITE"><arg1 type="int">0x</arg1></instruction>\n'
+	bad_escape = '<instruction order="{}" opcode="WRITE"><arg1 type="string">a\\12</arg1></instruction>\n'
+	bad_var = '<instruction order="{}" opcode="DEFVAR"><arg1 type="var">GF@1x</arg1></instruction>\n'
+	bad_label = '<instruction order="{}" opcode="JUMP"><arg1 type="label">nowhere</arg1></instruction>\n'
+	# (label, instructions, exit code, exit code and stdout with --lazy)
+	cases = [
+		("cold bad int", [write, exit, bad_int], 32, (0, b'ok')),
+		("hot bad int", [write, bad_int, exit], 32, (32, b'ok')),
+		("cold bad escape", [write, exit, bad_escape], 53, (0, b'ok')),
+		("hot bad escape", [write, bad_escape, exit], 53, (53, b'ok')),
+		("cold bad var", [write, exit, bad_var], 100, (0, b'ok')),
+		("hot bad var", [write, bad_var, exit], 100, (100, b'ok')),
+		("cold undefined label", [write, exit, bad_label], 52, (52, b'')),
+		]
+	failures = []
+	with tempfile.TemporaryDirectory() as tmpdir:
+		source = os.path.join(tmpdir, 'lazy.xml')
+		for label, instructions, exp_ecode, exp_lazy in cases:
+			with open(source, 'w') as f:
+				f.write(program.format(''.join(instr.format(order) for order, instr in enumerate(instructions, 1))))
+			for options, expected in (([], (exp_ecode, b'')), (["--lazy"], exp_lazy)):
+				ecode, out, err = run([f"--source={source}", *options])
+				if (ecode, out) != expected:
+					failures.append(f"lazy {label} {options}: exit code {ecode} and stdout {out!r}, expected {expected[0]} and {expected[1]!r}")
+	return failures
+
+# checks of what the test programs can not cover
+checks = [
+	check_batch_manifest,
+	check_checkpoint_resume,
+	check_bytecode_errors,
+	check_lazy_errors,
+	]
 
-for p in iprgs:
-	print(f'\n\nRunning {p}')
-	interpret.main([f"--source=test/{p}.xml", f"--input=input.txt"])
+def main():
+	names = sorted(f[:-4] for f in os.listdir(testdir) if f.endswith('.out'))
+	failures = []
+	with ThreadPoolExecutor() as pool:
+		for name, fails in zip(names, pool.map(check_program, names)):
+			print(f"{'FAIL' if fails else 'ok  '} {name}")
+			failures += fails
+		for check, fails in zip(checks, pool.map(lambda check: check(), checks)):
+			print(f"{'FAIL' if fails else 'ok  '} {check.__name__}")
+			failures += fails
+	for f in failures:
+		print(f)
+	print(f"{len(names)} programs, {len(failures)} failures")
+	return 1 if failures else 0
 
+if __name__ == '__main__':
+	sys.exit(main())